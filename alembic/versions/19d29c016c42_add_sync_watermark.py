@@ -0,0 +1,28 @@
+"""add watermark to etl_sync_state
+
+Revision ID: 19d29c016c42
+Revises: 3667ecbb0e18
+Create Date: 2026-10-16 11:03:17.502914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '19d29c016c42'
+down_revision: Union[str, Sequence[str], None] = '3667ecbb0e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('etl_sync_state', sa.Column('watermark', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('etl_sync_state', 'watermark')
@@ -0,0 +1,28 @@
+"""add digest to etl_sync_state
+
+Revision ID: 6f21c4bbc86a
+Revises: 228499ec344d
+Create Date: 2026-10-16 17:42:08.630172
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f21c4bbc86a'
+down_revision: Union[str, Sequence[str], None] = '228499ec344d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('etl_sync_state', sa.Column('digest', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('etl_sync_state', 'digest')
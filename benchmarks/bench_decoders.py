@@ -0,0 +1,115 @@
+"""
+Record decoding: hand-written dict construction with the old strptime-chain
+parse_date vs the compiled tuple decoders in src.etl.decoders.
+
+    python -m benchmarks.bench_decoders [--items 1000000]
+
+Items are synthetic contracts and plans shaped like OWS v3 responses, with
+the date formats the API mixes ('YYYY-MM-DD HH:MM:SS', ISO with 'T',
+fractions and 'Z'). JSON decoding of the same payload is timed with the
+standard library and, when installed, orjson.
+"""
+import json
+import time
+import random
+import argparse
+from datetime import datetime
+from src.etl.decoders import CONTRACT, PLAN
+
+def legacy_parse_date(date_str):
+    # the loaders' implementation before src.etl.decoders
+    if not date_str:
+        return None
+    try:
+        return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+            return dt.replace(tzinfo=None) if dt.tzinfo else dt
+        except (ValueError, TypeError):
+            return None
+
+def legacy_contract(item, bin_number):
+    raw_supplier_bin = item.get('supplier_biin')
+    trd_buy_id = item.get('trd_buy_id')
+    return dict(
+        id=item.get('id'), contract_number=item.get('contract_number'), trd_buy_id=trd_buy_id if trd_buy_id else None,
+        crdate=legacy_parse_date(item.get('crdate')), contract_sum=item.get('contract_sum'),
+        supplier_biin=raw_supplier_bin if raw_supplier_bin and str(raw_supplier_bin).strip() else None,
+        customer_bin=bin_number, ref_contract_status_id=item.get('ref_contract_status_id'),
+    )
+
+def legacy_plan(item, bin_number):
+    kato_list = item.get('kato', [])
+    return dict(
+        id=item['id'], subject_biin=bin_number, ref_enstru_code=item.get('ref_enstru_code'),
+        ref_units_code=item.get('ref_units_code'), price=item.get('price'), count=item.get('count'),
+        amount=item.get('amount'), date_approved=legacy_parse_date(item.get('date_approved')),
+        kato_code=kato_list[0].get('ref_kato_code') if kato_list else None,
+    )
+
+def random_date(rnd: random.Random) -> str:
+    moment = datetime(2024, 1, 1) + (datetime(2026, 1, 1) - datetime(2024, 1, 1)) * rnd.random()
+    style = rnd.random()
+    if style < 0.5:
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+    if style < 0.8:
+        return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def make_items(count: int, seed: int = 11):
+    rnd = random.Random(seed)
+    contracts, plans = [], []
+    for i in range(count // 2):
+        contracts.append({
+            'id': 20000000 + i, 'contract_number': f'C-{i}', 'trd_buy_id': rnd.choice([0, None, 5000000 + i]),
+            'crdate': random_date(rnd), 'index_date': random_date(rnd), 'contract_sum': round(rnd.uniform(1e3, 1e7), 2),
+            'supplier_biin': rnd.choice(['', ' ', None, f'{rnd.randrange(10 ** 11, 10 ** 12)}']),
+            'customer_bin': '000740001307', 'ref_contract_status_id': 330,
+        })
+        plans.append({
+            'id': 1000000 + i, 'ref_enstru_code': f'{rnd.randrange(100000, 999999)}.100.000000', 'ref_units_code': '796',
+            'price': round(rnd.uniform(100, 10000), 2), 'count': rnd.randint(1, 50), 'amount': 1,
+            'date_approved': random_date(rnd), 'kato': [{'ref_kato_code': '750000000'}], 'name_ru': f'План {i}',
+        })
+    return contracts, plans
+
+def timed(label: str, count: int, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<34} {elapsed:7.3f}s  {count / elapsed:12,.0f} items/s")
+    return elapsed, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000000)
+    args = parser.parse_args()
+
+    contracts, plans = make_items(args.items)
+    count = len(contracts) + len(plans)
+    print(f"{count:,} items ({len(contracts):,} contracts, {len(plans):,} plans)")
+
+    print("decoding")
+    legacy, legacy_rows = timed("legacy dicts + strptime chain", count, lambda: (
+        [legacy_contract(item, '000740001307') for item in contracts] + [legacy_plan(item, '000740001307') for item in plans]
+    ))
+    compiled, tuples = timed("compiled tuple decoders", count, lambda: (
+        [CONTRACT.decode(item) for item in contracts] + [PLAN.decode(item) for item in plans]
+    ))
+    _, rows = timed("compiled decoders, dict rows", count, lambda: (
+        [CONTRACT.row(item, customer_bin='000740001307') for item in contracts]
+        + [PLAN.row(item, subject_biin='000740001307') for item in plans]
+    ))
+    assert rows == legacy_rows, "compiled decoders disagree with the legacy decoding"
+    print(f"  tuple decoding speed-up: {legacy / compiled:.1f}x")
+
+    print("JSON")
+    payload = json.dumps({'items': contracts}).encode()
+    timed("json.loads", len(contracts), lambda: json.loads(payload))
+    try:
+        import orjson
+    except ImportError:
+        print("  orjson not installed, skipped")
+    else:
+        timed("orjson.loads", len(contracts), lambda: orjson.loads(payload))
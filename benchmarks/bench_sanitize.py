@@ -0,0 +1,73 @@
+"""
+Lot name sanitizer: per-string reference implementation vs sanitize_lot_texts.
+
+    python -m benchmarks.bench_sanitize [--size 200000] [--dirty 0.3]
+
+The sample mimics OWS lot names: mostly clean Cyrillic text, the rest with
+HTML entities, tags, non-breaking spaces and doubled whitespace.
+"""
+import re
+import html
+import time
+import random
+import argparse
+from src.utils.cleaners import sanitize_lot_texts
+
+WORDS = [
+    'Бумага', 'офисная', 'формата', 'А4', 'картридж', 'для', 'принтера', 'услуги', 'по', 'техническому',
+    'обслуживанию', 'здания', 'поставка', 'медицинских', 'изделий', 'шприц', 'одноразовый', 'бензин', 'АИ-92',
+    'ремонт', 'кровли', 'школы', '№', '12', 'г.', 'Алматы', 'продукты', 'питания', 'молоко', '3,2%',
+]
+DIRT = [
+    lambda s: s.replace(' ', '&nbsp;', 1),
+    lambda s: f'&laquo;{s}&raquo;',
+    lambda s: f'<p>{s}</p>',
+    lambda s: s.replace(' ', '  ', 2),
+    lambda s: f'{s}<br/>\n',
+    lambda s: s.replace(' ', '\xa0', 1),
+    lambda s: f'&quot;{s}&quot; &amp; Ко',
+]
+
+def reference_sanitize(text):
+    # the original one-string implementation, uncompiled patterns
+    if not text:
+        return text
+    cleaned = html.unescape(text)
+    cleaned = re.sub(r'<[^>]+>', ' ', cleaned)
+    cleaned = re.sub(r'\s+', ' ', cleaned)
+    return cleaned.strip()
+
+def make_sample(size: int, dirty: float, seed: int = 7):
+    rnd = random.Random(seed)
+    sample = []
+    for _ in range(size):
+        name = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 9)))
+        if rnd.random() < dirty:
+            name = rnd.choice(DIRT)(name)
+        sample.append(name)
+    return sample
+
+def best_of(runs: int, fn):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--dirty', type=float, default=0.3, help="share of names that need cleaning")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    sample = make_sample(args.size, args.dirty)
+    reference_time, expected = best_of(args.runs, lambda: [reference_sanitize(s) for s in sample])
+    batch_time, result = best_of(args.runs, lambda: sanitize_lot_texts(sample))
+    assert result == expected, "batch sanitizer output differs from the reference"
+
+    print(f"{args.size} lot names, {args.dirty:.0%} dirty, best of {args.runs}")
+    print(f"  reference, one string at a time: {reference_time:.3f}s ({args.size / reference_time:,.0f}/s)")
+    print(f"  sanitize_lot_texts:              {batch_time:.3f}s ({args.size / batch_time:,.0f}/s)")
+    print(f"  speed-up: {reference_time / batch_time:.1f}x")
@@ -0,0 +1,122 @@
+"""
+Equivalence check of the analytics backends against the live database:
+the pandas reference implementation, the SQL backend, the precomputed
+enstru_price_stats, the batch functions over all codes at once and, with
+PRICE_SNAPSHOT_DIR set, the memory-mapped price snapshot must give the same
+results for every KTRU code, and for every KATO and contract year the code
+was bought in. The engine's own functions answer from the snapshot then,
+for the codes it is current for.
+
+    python -m benchmarks.verify_backends [--limit 500] [--target-price 1000]
+
+Floats are compared with a relative tolerance (PostgreSQL sums numerics
+exactly, pandas in float64); everything else, including the example links,
+must be identical. Exits with status 1 on any mismatch.
+"""
+import math
+import argparse
+import logging
+from typing import Callable, Dict, List, Optional
+from pydantic import BaseModel
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from src.db.session import SessionLocal
+from src.db.models import Contract, ContractUnit, PlanPoint
+from src.analytics.engine import (
+    check_price_deviation, check_price_deviation_pandas, check_price_deviation_many,
+    get_fair_price_bounds, get_fair_price_bounds_pandas, fair_price_bounds_many,
+)
+from src.analytics.snapshot import current_snapshot
+from src.analytics.sql_engine import check_price_deviation_sql, get_fair_price_bounds_sql
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+REL_TOLERANCE = 1e-9
+
+def same(a: Optional[BaseModel], b: Optional[BaseModel]) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    a, b = a.model_dump(), b.model_dump()
+    for key, value in a.items():
+        if isinstance(value, float):
+            if not math.isclose(value, b[key], rel_tol=REL_TOLERANCE, abs_tol=REL_TOLERANCE):
+                return False
+        elif value != b[key]:
+            return False
+    return True
+
+def compare(label: str, results: Dict[str, Optional[BaseModel]]) -> bool:
+    reference = results['pandas']
+    mismatched = [name for name, result in results.items() if not same(reference, result)]
+    for name in mismatched:
+        logger.error(f"{label}: {name} differs from pandas\n  pandas: {reference}\n  {name}: {results[name]}")
+    return not mismatched
+
+def verify(db: Session, limit: Optional[int], target_price: float) -> int:
+    combos = select(
+        PlanPoint.ref_enstru_code, PlanPoint.kato_code, func.extract('year', Contract.crdate)
+    ).join(
+        ContractUnit, ContractUnit.pln_point_id == PlanPoint.id
+    ).join(
+        Contract, ContractUnit.contract_id == Contract.id
+    ).where(PlanPoint.ref_enstru_code.isnot(None)).distinct()
+    by_code: Dict[str, set] = {}
+    for code, kato, year in db.execute(combos):
+        by_code.setdefault(code, set()).add((kato, int(year) if year else None))
+    codes: List[str] = sorted(by_code)[:limit]
+
+    # the batch functions answer for every code at once, per KATO/year filter
+    batch_deviation = check_price_deviation_many(db, {code: target_price for code in codes})
+    batch_fair: Dict[tuple, dict] = {}
+
+    def fair_many(db: Session, code: str, kato: Optional[str], year: Optional[int]):
+        if (kato, year) not in batch_fair:
+            batch_fair[kato, year] = fair_price_bounds_many(db, codes, kato, year)
+        return batch_fair[kato, year][code]
+
+    snapshot = current_snapshot()
+
+    checks = 0
+    failures = 0
+    for code in codes:
+        deviation: Dict[str, Callable] = dict(
+            pandas=check_price_deviation_pandas, sql=check_price_deviation_sql, precomputed=check_price_deviation,
+            batch=lambda db, code, target: batch_deviation[code],
+        )
+        if snapshot is not None:
+            deviation['snapshot'] = lambda db, code, target: snapshot.check_price_deviation(code, target)
+        checks += 1
+        failures += not compare(f"deviation {code}", {name: fn(db, code, target_price) for name, fn in deviation.items()})
+
+        filters = {(None, None)}
+        for kato, year in by_code[code]:
+            filters.update({(kato, None), (None, year), (kato, year)})
+        fair: Dict[str, Callable] = dict(
+            pandas=get_fair_price_bounds_pandas, sql=get_fair_price_bounds_sql, precomputed=get_fair_price_bounds,
+            batch=fair_many,
+        )
+        if snapshot is not None:
+            fair['snapshot'] = lambda db, code, kato, year: snapshot.get_fair_price_bounds(code, kato, year)
+        for kato, year in sorted(filters, key=str):
+            checks += 1
+            failures += not compare(
+                f"fair price {code} kato={kato} year={year}",
+                {name: fn(db, code, kato, year) for name, fn in fair.items()},
+            )
+    logger.info(f"{len(codes)} codes, {checks} comparisons, {failures} mismatches")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--limit', type=int, help="check only the first N codes")
+    parser.add_argument('--target-price', type=float, default=1000.0)
+    args = parser.parse_args()
+
+    db_session = SessionLocal()
+    try:
+        failed = verify(db_session, args.limit, args.target_price)
+    finally:
+        db_session.close()
+    if failed:
+        raise SystemExit(1)
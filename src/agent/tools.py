@@ -9,8 +9,11 @@ from src.analytics.engine import (
     analyze_price_dynamics,
     check_price_deviation,
     detect_volume_anomaly,
+    fair_price_bounds_many,
+    get_anomalies,
     get_fair_price_bounds,
     get_top_contracts,
+    scan_price_deviation,
 )
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -89,12 +92,57 @@ def build_tools(db: Session) -> List:
             logger.exception("Error in 'get_top_contracts' tool")
             return [{"error": str(e)}]
 
+    @tool
+    def scan_price_deviation_tool(customer_bin: str, limit: int = 20) -> dict:
+        """Check every KTRU a customer BIN bought against the market weighted average, anomalies first."""
+        logger.info(
+            f"Tool 'scan_price_deviation' called with customer_bin={customer_bin}, limit={limit}"
+        )
+        try:
+            res = scan_price_deviation(db, customer_bin, limit)
+            return res
+        except Exception as e:
+            logger.exception("Error in 'scan_price_deviation' tool")
+            return {"error": str(e)}
+
+    @tool
+    def get_fair_price_many_tool(enstru_codes: List[str], kato_code: str | None = None, year_filter: int | None = None) -> dict:
+        """Calculate fair price bounds (IQR + median) for several KTRU codes at once, optionally by KATO and year."""
+        logger.info(
+            f"Tool 'get_fair_price_many' called with {len(enstru_codes)} codes, kato_code={kato_code}, year_filter={year_filter}"
+        )
+        try:
+            res = fair_price_bounds_many(db, enstru_codes, kato_code, year_filter)
+            return {
+                code: bounds.model_dump() if bounds else {"error": "Insufficient data to calculate fair price."}
+                for code, bounds in res.items()
+            }
+        except Exception as e:
+            logger.exception("Error in 'get_fair_price_many' tool")
+            return {"error": str(e)}
+
+    @tool
+    def get_anomalies_tool(customer_bin: str, kind: str | None = None, limit: int = 20) -> dict:
+        """Return the anomalies of a customer BIN found by the nightly scan, optionally one kind: price_deviation, fair_price or volume."""
+        logger.info(
+            f"Tool 'get_anomalies' called with customer_bin={customer_bin}, kind={kind}, limit={limit}"
+        )
+        try:
+            res = get_anomalies(db, customer_bin, kind, limit)
+            return res
+        except Exception as e:
+            logger.exception("Error in 'get_anomalies' tool")
+            return {"error": str(e)}
+
     return [
         check_price_deviation_tool,
         detect_volume_anomaly_tool,
         get_fair_price_tool,
         analyze_price_dynamics_tool,
         get_top_contracts_tool,
+        scan_price_deviation_tool,
+        get_fair_price_many_tool,
+        get_anomalies_tool,
     ]
 
 def execute_tool(tool_name: str, arguments: str, db: Session) -> str:
@@ -121,6 +169,21 @@ def execute_tool(tool_name: str, arguments: str, db: Session) -> str:
         elif tool_name == "get_top_contracts":
             res = get_top_contracts(db, args["customer_bin"], args.get("limit", 5))
             result_json = json.dumps(res)
+
+        elif tool_name == "scan_price_deviation":
+            res = scan_price_deviation(db, args["customer_bin"], args.get("limit", 20))
+            result_json = json.dumps(res)
+
+        elif tool_name == "get_fair_price_many":
+            res = fair_price_bounds_many(db, args["enstru_codes"], args.get("kato_code"), args.get("year_filter"))
+            result_json = json.dumps({
+                code: bounds.model_dump() if bounds else {"error": "Insufficient data to calculate fair price."}
+                for code, bounds in res.items()
+            })
+
+        elif tool_name == "get_anomalies":
+            res = get_anomalies(db, args["customer_bin"], args.get("kind"), args.get("limit", 20))
+            result_json = json.dumps(res)
             
         else:
             result_json = json.dumps({"error": "Unknown tool."})
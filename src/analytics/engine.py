@@ -2,37 +2,45 @@ import pandas as pd
 from typing import Optional, List, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from pydantic import BaseModel
-from src.db.models import Contract, ContractUnit, PlanPoint
-
-class PriceDeviationResult(BaseModel):
-    enstru_code: str
-    weighted_average_price: float
-    target_price: float
-    deviation_percentage: float
-    is_anomalous: bool
-    sample_size_units: int
-    top_k_links: List[str]
-
-class VolumeAnomalyResult(BaseModel):
-    customer_bin: str
-    enstru_code: str
-    yearly_volumes: Dict[int, float]
-    is_anomalous: bool
-    description: str
-    top_k_links: List[str]
-
-class FairPriceResult(BaseModel):
-    enstru_code: str
-    kato_code: Optional[str]
-    time_period: str
-    median_price: float
-    fair_min: float
-    fair_max: float
-    confidence: str
-    top_k_links: List[str]
+from src.config import ANALYTICS_BACKEND
+from src.db.models import Anomaly, Contract, ContractUnit, PlanPoint
+from src.analytics.price_stats import NO_DATA, cached_stats, snapshot_is_current, stats_many
+from src.analytics.results import (
+    PriceDeviationResult, VolumeAnomalyResult, FairPriceResult,
+    contract_links, price_deviation_result, fair_price_result, volume_anomaly_result, price_dynamics_result,
+)
+from src.analytics.snapshot import PriceSnapshot, current_snapshot
+from src.analytics.sql_engine import check_price_deviation_sql, get_fair_price_bounds_sql
+
+def fresh_snapshot(db: Session, enstru_code: str) -> Optional[PriceSnapshot]:
+    """
+    The memory-mapped snapshot when PRICE_SNAPSHOT_DIR is set and it still
+    holds the code's current units. It is rebuilt every few hours; codes
+    written or refreshed since answer from the database instead.
+    """
+    snapshot = current_snapshot()
+    if snapshot is not None and snapshot.has(enstru_code) and snapshot_is_current(db, enstru_code, snapshot.built_at):
+        return snapshot
+    return None
 
 def check_price_deviation(db: Session, enstru_code: str, target_price: float) -> Optional[PriceDeviationResult]:
+    snapshot = fresh_snapshot(db, enstru_code)
+    if snapshot is not None:
+        return snapshot.check_price_deviation(enstru_code, target_price)
+    # precomputed by the ETL, a live computation only for codes not refreshed yet
+    stats = cached_stats(db, enstru_code)
+    if stats is not None:
+        return deviation_from_stats(enstru_code, target_price, stats)
+    return LIVE_BACKENDS[ANALYTICS_BACKEND][0](db, enstru_code, target_price)
+
+def deviation_from_stats(enstru_code: str, target_price: float, stats) -> Optional[PriceDeviationResult]:
+    return price_deviation_result(
+        enstru_code, target_price, stats.weighted_value or 0, stats.weighted_quantity or 0,
+        stats.weighted_units or 0, stats.top_contract_ids or []
+    )
+
+def check_price_deviation_pandas(db: Session, enstru_code: str, target_price: float) -> Optional[PriceDeviationResult]:
+    # reference implementation, sql_engine computes the same inside PostgreSQL
     query = db.query(
         ContractUnit.item_price,
         ContractUnit.quantity,
@@ -43,7 +51,7 @@ def check_price_deviation(db: Session, enstru_code: str, target_price: float) ->
         PlanPoint.ref_enstru_code == enstru_code,
         ContractUnit.item_price != None,
         ContractUnit.quantity != None
-    )
+    ).order_by(ContractUnit.id)
     
     results = query.all()
     if not results:
@@ -55,29 +63,14 @@ def check_price_deviation(db: Session, enstru_code: str, target_price: float) ->
     
     total_value = (df['price'] * df['quantity']).sum()
     total_quantity = df['quantity'].sum()
-    
-    if total_quantity == 0:
-        return None
-        
-    w_avg_price = total_value / total_quantity
-    
-    deviation = ((target_price - w_avg_price) / w_avg_price) * 100
-    is_anomalous = abs(deviation) > 30.0
-    
     top_k_ids = df.nlargest(3, 'price')['contract_id'].unique()
-    top_k_links = [f"https://goszakup.gov.kz/ru/contract/show/{cid}" for cid in top_k_ids]
     
-    return PriceDeviationResult(
-        enstru_code=enstru_code,
-        weighted_average_price=float(w_avg_price),
-        target_price=target_price,
-        deviation_percentage=float(deviation),
-        is_anomalous=is_anomalous,
-        sample_size_units=len(df),
-        top_k_links=top_k_links
-    )
+    return price_deviation_result(enstru_code, target_price, total_value, total_quantity, len(df), top_k_ids)
 
 def detect_volume_anomaly(db: Session, customer_bin: str, enstru_code: str) -> Optional[VolumeAnomalyResult]:
+    snapshot = fresh_snapshot(db, enstru_code)
+    if snapshot is not None:
+        return snapshot.detect_volume_anomaly(customer_bin, enstru_code)
     query = db.query(
         func.extract('year', Contract.crdate).label('year'),
         func.sum(ContractUnit.quantity).label('total_qty'),
@@ -99,35 +92,28 @@ def detect_volume_anomaly(db: Session, customer_bin: str, enstru_code: str) -> O
 
     yearly_vols = {int(row.year): float(row.total_qty) for row in results}
     sample_ids = [row.latest_contract_id for row in results if row.latest_contract_id]
-    
-    # anomaly - if the latest year's volume is > 200% of the historical average
-    is_anomalous = False
-    description = "Normal volume trends."
-    
-    years = sorted(list(yearly_vols.keys()))
-    if len(years) > 1:
-        latest_year = years[-1]
-        latest_vol = yearly_vols[latest_year]
-        historical_vols = [yearly_vols[y] for y in years[:-1]]
-        hist_avg = sum(historical_vols) / len(historical_vols)
-        
-        if hist_avg > 0 and latest_vol > (hist_avg * 2): # x2 increase
-            is_anomalous = True
-            description = f"Volume in {latest_year} ({latest_vol}) is significantly higher than historical average ({hist_avg:.2f})."
+    return volume_anomaly_result(customer_bin, enstru_code, yearly_vols, sample_ids)
 
-    # the top 3 contracts as links
-    top_k_links = [f"https://goszakup.gov.kz/ru/contract/show/{cid}" for cid in sample_ids[-3:]]
-
-    return VolumeAnomalyResult(
-        customer_bin=customer_bin,
-        enstru_code=enstru_code,
-        yearly_volumes=yearly_vols,
-        is_anomalous=is_anomalous,
-        description=description,
-        top_k_links=top_k_links
+def get_fair_price_bounds(db: Session, enstru_code: str, kato_code: Optional[str] = None, year_filter: Optional[int] = None) -> Optional[FairPriceResult]:
+    snapshot = fresh_snapshot(db, enstru_code)
+    if snapshot is not None:
+        return snapshot.get_fair_price_bounds(enstru_code, kato_code, year_filter)
+    # precomputed by the ETL, a live computation only for codes not refreshed yet
+    stats = cached_stats(db, enstru_code, kato_code, year_filter)
+    if stats is NO_DATA:
+        return None
+    if stats is not None:
+        return fair_price_from_stats(enstru_code, kato_code, year_filter, stats)
+    return LIVE_BACKENDS[ANALYTICS_BACKEND][1](db, enstru_code, kato_code, year_filter)
+
+def fair_price_from_stats(enstru_code: str, kato_code: Optional[str], year_filter: Optional[int], stats) -> Optional[FairPriceResult]:
+    return fair_price_result(
+        enstru_code, kato_code, year_filter, stats.price_count or 0,
+        stats.q1, stats.median, stats.q3, stats.median_contract_ids or []
     )
 
-def get_fair_price_bounds(db: Session, enstru_code: str, kato_code: Optional[str] = None, year_filter: Optional[int] = None) -> Optional[FairPriceResult]:
+def get_fair_price_bounds_pandas(db: Session, enstru_code: str, kato_code: Optional[str] = None, year_filter: Optional[int] = None) -> Optional[FairPriceResult]:
+    # reference implementation, sql_engine computes the same inside PostgreSQL
     query = db.query(
         ContractUnit.item_price,
         ContractUnit.contract_id
@@ -145,7 +131,8 @@ def get_fair_price_bounds(db: Session, enstru_code: str, kato_code: Optional[str
     if year_filter:
         query = query.filter(func.extract('year', Contract.crdate) == year_filter)
 
-    results = query.all()
+    # unit order breaks ties between equally priced examples
+    results = query.order_by(ContractUnit.id).all()
     if not results or len(results) < 3:
         return None
 
@@ -154,29 +141,98 @@ def get_fair_price_bounds(db: Session, enstru_code: str, kato_code: Optional[str
     
     q1 = df['price'].quantile(0.25)
     q3 = df['price'].quantile(0.75)
-    iqr = q3 - q1
     median = df['price'].median()
 
-    lower_bound = max(0, q1 - (1.5 * iqr))
-    upper_bound = q3 + (1.5 * iqr)
-
     # the top 3 contracts as links
-    median_examples = df.iloc[(df['price'] - median).abs().argsort()[:3]]
-    top_k_links = [f"https://goszakup.gov.kz/ru/contract/show/{cid}" for cid in median_examples['contract_id'].unique()]
-
-    return FairPriceResult(
-        enstru_code=enstru_code,
-        kato_code=kato_code,
-        time_period=str(year_filter) if year_filter else "All Time",
-        median_price=float(median),
-        fair_min=float(lower_bound),
-        fair_max=float(upper_bound),
-        confidence="High" if len(df) >= 30 else "Medium",
-        top_k_links=top_k_links
+    median_examples = df.iloc[(df['price'] - median).abs().argsort(kind='stable')[:3]]
+
+    return fair_price_result(
+        enstru_code, kato_code, year_filter, len(df), q1, median, q3, median_examples['contract_id'].unique()
     )
 
 
+# computations behind the precomputed statistics, selected by ANALYTICS_BACKEND
+LIVE_BACKENDS = {
+    'pandas': (check_price_deviation_pandas, get_fair_price_bounds_pandas),
+    'sql': (check_price_deviation_sql, get_fair_price_bounds_sql),
+}
+if ANALYTICS_BACKEND not in LIVE_BACKENDS:
+    raise ValueError(f"Unknown ANALYTICS_BACKEND {ANALYTICS_BACKEND!r}, expected one of {', '.join(LIVE_BACKENDS)}")
+
+# batch versions for many codes, one grouped pass instead of a query per code
+def check_price_deviation_many(db: Session, target_prices: Dict[str, float]) -> Dict[str, Optional[PriceDeviationResult]]:
+    stats = stats_many(db, list(target_prices))
+    return {
+        code: deviation_from_stats(code, target_price, stats[code]) if stats[code] is not None else None
+        for code, target_price in target_prices.items()
+    }
+
+def fair_price_bounds_many(db: Session, enstru_codes: List[str], kato_code: Optional[str] = None, year_filter: Optional[int] = None) -> Dict[str, Optional[FairPriceResult]]:
+    stats = stats_many(db, enstru_codes, kato_code, year_filter)
+    return {
+        code: fair_price_from_stats(code, kato_code, year_filter, row) if row is not None else None
+        for code, row in stats.items()
+    }
+
+def scan_price_deviation(db: Session, customer_bin: str, limit: Optional[int] = None) -> Dict[str, Any]:
+    # the customer's own weighted average price per code is the target checked against the market
+    purchases = db.query(
+        PlanPoint.ref_enstru_code.label('enstru_code'),
+        func.sum(ContractUnit.item_price * ContractUnit.quantity).label('spent'),
+        func.sum(ContractUnit.quantity).label('quantity'),
+        func.count().label('units'),
+    ).join(
+        PlanPoint, ContractUnit.pln_point_id == PlanPoint.id
+    ).join(
+        Contract, ContractUnit.contract_id == Contract.id
+    ).filter(
+        Contract.customer_bin == customer_bin,
+        PlanPoint.ref_enstru_code != None,
+        ContractUnit.item_price != None,
+        ContractUnit.quantity != None
+    ).group_by(
+        PlanPoint.ref_enstru_code
+    ).having(
+        func.sum(ContractUnit.quantity) != 0
+    ).all()
+
+    if not purchases:
+        return {"error": f"No priced purchases found for BIN {customer_bin}."}
+
+    bought = {row.enstru_code: row for row in purchases}
+    deviations = check_price_deviation_many(db, {
+        code: float(row.spent) / float(row.quantity) for code, row in bought.items()
+    })
+
+    findings = []
+    for code, res in deviations.items():
+        if res is None:
+            continue
+        findings.append({
+            **res.model_dump(),
+            "customer_units": int(bought[code].units),
+            "customer_spent_kzt": float(bought[code].spent),
+        })
+    # anomalies first, the largest deviations on top
+    findings.sort(key=lambda f: (not f["is_anomalous"], -abs(f["deviation_percentage"]), f["enstru_code"]))
+
+    return {
+        "analysis_type": "portfolio_price_deviation",
+        "customer_bin": customer_bin,
+        "codes_checked": len(findings),
+        "anomalous_count": sum(f["is_anomalous"] for f in findings),
+        "results": findings[:limit],
+        "note_to_llm": (
+            "target_price is the customer's own weighted average price for the KTRU, compared to the "
+            "weighted average of all purchases. Results are sorted with anomalies first. When giving "
+            "example links, ONLY use the provided 'top_k_links'."
+        ),
+    }
+
 def analyze_price_dynamics(db: Session, enstru_code: str) -> Dict[str, Any]:
+    snapshot = fresh_snapshot(db, enstru_code)
+    if snapshot is not None:
+        return snapshot.analyze_price_dynamics(enstru_code)
     results = db.query(
         func.extract("year", Contract.crdate).label("year"),
         func.extract("month", Contract.crdate).label("month"),
@@ -199,45 +255,7 @@ def analyze_price_dynamics(db: Session, enstru_code: str) -> Dict[str, Any]:
         "month",
     ).all()
 
-    if not results:
-        return {"error": f"No historical price data found for ENSTRU code {enstru_code}."}
-
-    timeline: Dict[int, Dict[str, Dict[str, Any]]] = {}
-    sample_contract_ids: List[int] = []
-
-    for row in results:
-        year = int(row.year)
-        month = int(row.month)
-        avg_price = round(float(row.avg_price), 2)
-
-        if year not in timeline:
-            timeline[year] = {}
-
-        timeline[year][f"Month_{month}"] = {
-            "average_price": avg_price,
-            "purchase_count": int(row.purchase_count),
-        }
-
-        if row.sample_contract_id:
-            sample_contract_ids.append(int(row.sample_contract_id))
-
-    # Use up to 5 example contracts as direct links for the LLM.
-    unique_ids = list(dict.fromkeys(sample_contract_ids))[:5]
-    top_k_links = [
-        f"https://goszakup.gov.kz/ru/contract/show/{cid}" for cid in unique_ids
-    ]
-
-    return {
-        "enstru_code": enstru_code,
-        "analysis_type": "price_dynamics_and_seasonality",
-        "timeline": timeline,
-        "top_k_links": top_k_links,
-        "note_to_llm": (
-            "Use this chronological data to calculate inflation percentages between years "
-            "and identify seasonal price spikes in specific months. When giving example links, "
-            "ONLY use the provided 'top_k_links' and do not fabricate generic URLs."
-        ),
-    }
+    return price_dynamics_result(enstru_code, results)
 
 
 def get_top_contracts(db: Session, customer_bin: str, limit: int = 5) -> Dict[str, Any]:
@@ -270,4 +288,38 @@ def get_top_contracts(db: Session, customer_bin: str, limit: int = 5) -> Dict[st
         "total_sum_of_top_k": total_spent_in_top_k,
         "top_contracts": top_k_list,
         "note_to_llm": "Use this data to list the Top-K most expensive contracts. Ensure you provide the exact links in your final output.",
-    }
\ No newline at end of file
+    }
+
+
+def get_anomalies(db: Session, customer_bin: str, kind: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+    # precomputed by the nightly anomaly scan, a primary key range lookup
+    query = db.query(Anomaly).filter(Anomaly.customer_bin == customer_bin)
+    if kind:
+        query = query.filter(Anomaly.kind == kind)
+    anomalies = query.order_by(func.abs(Anomaly.score).desc(), Anomaly.enstru_code, Anomaly.kind).limit(limit).all()
+
+    if not anomalies:
+        return {"error": f"No anomalies found for BIN {customer_bin} in the last nightly scan."}
+
+    return {
+        "analysis_type": "precomputed_anomalies",
+        "customer_bin": customer_bin,
+        "detected_at": max(a.detected_at for a in anomalies).strftime("%Y-%m-%d %H:%M"),
+        "anomalies": [
+            {
+                "kind": a.kind,
+                "enstru_code": a.enstru_code,
+                "deviation_percentage": a.score,
+                "customer_value": a.value,
+                "reference_value": a.reference,
+                "description": a.description,
+                "top_k_links": contract_links(a.contract_ids or []),
+            }
+            for a in anomalies
+        ],
+        "note_to_llm": (
+            "Anomalies found by the nightly scan, the largest deviations first. kind is price_deviation "
+            "(weighted average price vs the market), fair_price (median price outside the IQR bounds) or "
+            "volume (latest yearly quantity vs the historical average). Ensure you provide the exact links."
+        ),
+    }
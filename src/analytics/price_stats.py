@@ -0,0 +1,161 @@
+import pandas as pd
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Set
+from sqlalchemy import Select, exists, func, select, tuple_
+from sqlalchemy.orm import Session
+from src.db.models import Contract, ContractUnit, PlanPoint, EnstruPriceStats, EnstruPriceStale
+
+# precomputed levels below the code; '' and 0 in the key mean "all KATO" and "all years"
+LEVELS = [(), ('kato_code',), ('year',), ('kato_code', 'year')]
+EXAMPLES = 3
+STAT_COLUMNS = (
+    'weighted_value', 'weighted_quantity', 'weighted_units', 'top_contract_ids',
+    'price_count', 'q1', 'median', 'q3', 'median_contract_ids',
+)
+
+# lookup result for a code whose statistics are fresh but have no units for the KATO/year asked
+NO_DATA = object()
+
+def cached_stats(db: Session, enstru_code: str, kato_code: Optional[str] = None, year: Optional[int] = None):
+    """
+    The fresh statistics row, NO_DATA when the code is fresh but nothing
+    matches the KATO/year, None when the code is not precomputed or stale.
+    """
+    if queued_codes(db, [enstru_code]):
+        return None
+    row = db.get(EnstruPriceStats, (enstru_code, kato_code or '', year or 0))
+    if row is not None:
+        return row
+    if not kato_code and not year:
+        return None
+    base = db.get(EnstruPriceStats, (enstru_code, '', 0))
+    return NO_DATA if base is not None else None
+
+def snapshot_is_current(db: Session, enstru_code: str, built_at: datetime) -> bool:
+    """
+    False when units of the code may have changed since a snapshot read them
+    at `built_at`: the code is queued for a refresh, or its statistics were
+    recomputed after that.
+    """
+    return not db.scalar(select(
+        exists().where(EnstruPriceStale.enstru_code == enstru_code)
+        | exists().where(EnstruPriceStats.enstru_code == enstru_code, EnstruPriceStats.updated_at > built_at)
+    ))
+
+def queued_codes(db: Session, enstru_codes: Sequence[str]) -> Set[str]:
+    """The codes among `enstru_codes` waiting in enstru_price_stale for a refresh."""
+    return set(db.scalars(
+        select(EnstruPriceStale.enstru_code).where(EnstruPriceStale.enstru_code.in_(enstru_codes)).distinct()
+    ))
+
+def stats_many(db: Session, enstru_codes: Sequence[str], kato_code: Optional[str] = None,
+               year: Optional[int] = None) -> Dict[str, Optional[EnstruPriceStats]]:
+    """
+    Statistics of every code in `enstru_codes` at one KATO/year level, None
+    where the code has no units there. Fresh rows are read in one query, the
+    stale and missing codes computed together in one grouped pass over their
+    units; those come back as transient rows, nothing is written.
+    """
+    key = (kato_code or '', year or 0)
+    levels = {
+        (row.enstru_code, row.kato_code, row.year): row
+        for row in db.scalars(select(EnstruPriceStats).where(
+            EnstruPriceStats.enstru_code.in_(enstru_codes),
+            tuple_(EnstruPriceStats.kato_code, EnstruPriceStats.year).in_([key, ('', 0)]),
+        ))
+    }
+
+    queued = queued_codes(db, enstru_codes)
+
+    # the same decisions as cached_stats, per code
+    stats, live = {}, []
+    for code in dict.fromkeys(enstru_codes):
+        row, base = levels.get((code, *key)), levels.get((code, '', 0))
+        if code in queued:
+            live.append(code)
+        elif row is not None:
+            stats[code] = row
+        elif base is not None:
+            stats[code] = None
+        else:
+            live.append(code)
+
+    if live:
+        computed = {
+            (row['enstru_code'], row['kato_code'], row['year']): row
+            for row in price_stats_rows(stats_frame(db.execute(units_select(live)).all()))
+        }
+        for code in live:
+            row = computed.get((code, *key))
+            stats[code] = EnstruPriceStats(**row) if row is not None else None
+    return stats
+
+def _example_ids(df: pd.DataFrame, keys: List[str], order: pd.Series) -> pd.Series:
+    # contract ids of the first EXAMPLES rows per group in `order`, duplicates dropped
+    ranked = df.assign(_order=order).sort_values('_order', kind='stable')
+    head = ranked.groupby(keys, sort=False).head(EXAMPLES).dropna(subset=['contract_id'])
+    return head.groupby(keys, sort=False)['contract_id'].agg(lambda ids: list(dict.fromkeys(int(i) for i in ids)))
+
+def price_stats_rows(df: pd.DataFrame) -> List[dict]:
+    """
+    EnstruPriceStats rows for every code in `df` and every level in LEVELS.
+
+    `df` holds one row per contract unit with a price: enstru_code, kato_code,
+    year, price, quantity, contract_id (year and contract_id NaN without a
+    contract). The weighted average inputs mirror check_price_deviation, the
+    quartiles and examples get_fair_price_bounds (linear interpolation, like
+    pandas' quantile and PostgreSQL's percentile_cont).
+    """
+    rows = {}
+
+    weighted = df[df['quantity'].notna()]
+    if not weighted.empty:
+        grouped = weighted.assign(value=weighted['price'] * weighted['quantity']).groupby('enstru_code')
+        totals = grouped.agg(weighted_value=('value', 'sum'), weighted_quantity=('quantity', 'sum'), weighted_units=('price', 'size'))
+        top_ids = _example_ids(weighted, ['enstru_code'], -weighted['price'])
+        for code, total in totals.iterrows():
+            rows[(code, '', 0)] = dict(
+                weighted_value=float(total.weighted_value), weighted_quantity=float(total.weighted_quantity),
+                weighted_units=int(total.weighted_units), top_contract_ids=top_ids.get(code, []),
+            )
+
+    # fair price bounds join units to their contract
+    priced = df[df['contract_id'].notna()]
+    for level in LEVELS if not priced.empty else ():
+        keys = ['enstru_code', *level]
+        grouped = priced.groupby(keys)['price']
+        stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+        stats['count'] = grouped.size()
+        medians = priced[keys].merge(stats[0.5].rename('median').reset_index(), on=keys, how='left')['median']
+        stats['ids'] = _example_ids(priced, keys, (priced['price'] - medians.to_numpy()).abs())
+        for key, group in stats.iterrows():
+            values = dict(zip(keys, key if isinstance(key, tuple) else (key,)))
+            rows.setdefault((values['enstru_code'], values.get('kato_code', ''), int(values.get('year', 0))), {}).update(
+                price_count=int(group['count']), q1=float(group[0.25]), median=float(group[0.5]), q3=float(group[0.75]),
+                median_contract_ids=group['ids'],
+            )
+
+    return [
+        dict(enstru_code=code, kato_code=kato, year=year, **{c: values.get(c) for c in STAT_COLUMNS})
+        for (code, kato, year), values in rows.items()
+    ]
+
+def units_select(enstru_codes: Sequence[str]) -> Select:
+    # the priced units of `enstru_codes` in the layout of stats_frame
+    return (
+        select(
+            PlanPoint.ref_enstru_code, PlanPoint.kato_code, func.extract('year', Contract.crdate),
+            ContractUnit.item_price, ContractUnit.quantity, ContractUnit.contract_id,
+        )
+        .join(PlanPoint, ContractUnit.pln_point_id == PlanPoint.id)
+        .outerjoin(Contract, ContractUnit.contract_id == Contract.id)
+        .where(PlanPoint.ref_enstru_code.in_(enstru_codes), ContractUnit.item_price.isnot(None))
+        # unit order breaks ties between equally priced examples, as in the live engines
+        .order_by(ContractUnit.id)
+    )
+
+def stats_frame(rows: Sequence) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=['enstru_code', 'kato_code', 'year', 'price', 'quantity', 'contract_id'])
+    for column in ('year', 'price', 'quantity', 'contract_id'):
+        df[column] = pd.to_numeric(df[column])
+    return df
@@ -0,0 +1,151 @@
+from typing import Optional, List, Dict, Tuple, Any, NamedTuple, Sequence
+from pydantic import BaseModel
+
+class PriceDeviationResult(BaseModel):
+    enstru_code: str
+    weighted_average_price: float
+    target_price: float
+    deviation_percentage: float
+    is_anomalous: bool
+    sample_size_units: int
+    top_k_links: List[str]
+
+class VolumeAnomalyResult(BaseModel):
+    customer_bin: str
+    enstru_code: str
+    yearly_volumes: Dict[int, float]
+    is_anomalous: bool
+    description: str
+    top_k_links: List[str]
+
+class FairPriceResult(BaseModel):
+    enstru_code: str
+    kato_code: Optional[str]
+    time_period: str
+    median_price: float
+    fair_min: float
+    fair_max: float
+    confidence: str
+    top_k_links: List[str]
+
+class MonthlyPrice(NamedTuple):
+    year: int
+    month: int
+    avg_price: float
+    purchase_count: int
+    sample_contract_id: Optional[int]
+
+def contract_links(contract_ids) -> List[str]:
+    return [f"https://goszakup.gov.kz/ru/contract/show/{cid}" for cid in contract_ids]
+
+def price_deviation_result(enstru_code: str, target_price: float, total_value: float, total_quantity: float,
+                           sample_size: int, contract_ids) -> Optional[PriceDeviationResult]:
+    if total_quantity == 0:
+        return None
+
+    w_avg_price = total_value / total_quantity
+    
+    deviation = ((target_price - w_avg_price) / w_avg_price) * 100
+    is_anomalous = abs(deviation) > 30.0
+    
+    return PriceDeviationResult(
+        enstru_code=enstru_code,
+        weighted_average_price=float(w_avg_price),
+        target_price=target_price,
+        deviation_percentage=float(deviation),
+        is_anomalous=is_anomalous,
+        sample_size_units=sample_size,
+        top_k_links=contract_links(contract_ids)
+    )
+
+def fair_price_result(enstru_code: str, kato_code: Optional[str], year_filter: Optional[int], count: int,
+                      q1: float, median: float, q3: float, contract_ids) -> Optional[FairPriceResult]:
+    if count < 3:
+        return None
+
+    iqr = q3 - q1
+    lower_bound = max(0, q1 - (1.5 * iqr))
+    upper_bound = q3 + (1.5 * iqr)
+
+    return FairPriceResult(
+        enstru_code=enstru_code,
+        kato_code=kato_code,
+        time_period=str(year_filter) if year_filter else "All Time",
+        median_price=float(median),
+        fair_min=float(lower_bound),
+        fair_max=float(upper_bound),
+        confidence="High" if count >= 30 else "Medium",
+        top_k_links=contract_links(contract_ids)
+    )
+
+
+def volume_growth(yearly_vols: Dict[int, float]) -> Optional[Tuple[int, float, float]]:
+    # latest year, its volume and the average of the years before
+    years = sorted(list(yearly_vols.keys()))
+    if len(years) < 2:
+        return None
+    latest_year = years[-1]
+    historical_vols = [yearly_vols[y] for y in years[:-1]]
+    return latest_year, yearly_vols[latest_year], sum(historical_vols) / len(historical_vols)
+
+def volume_anomaly_result(customer_bin: str, enstru_code: str, yearly_vols: Dict[int, float],
+                          sample_ids: List[int]) -> VolumeAnomalyResult:
+    # anomaly - if the latest year's volume is > 200% of the historical average
+    is_anomalous = False
+    description = "Normal volume trends."
+
+    growth = volume_growth(yearly_vols)
+    if growth is not None:
+        latest_year, latest_vol, hist_avg = growth
+        if hist_avg > 0 and latest_vol > (hist_avg * 2): # x2 increase
+            is_anomalous = True
+            description = f"Volume in {latest_year} ({latest_vol}) is significantly higher than historical average ({hist_avg:.2f})."
+
+    return VolumeAnomalyResult(
+        customer_bin=customer_bin,
+        enstru_code=enstru_code,
+        yearly_volumes=yearly_vols,
+        is_anomalous=is_anomalous,
+        description=description,
+        # the top 3 contracts as links
+        top_k_links=contract_links(sample_ids[-3:])
+    )
+
+def price_dynamics_result(enstru_code: str, results: Sequence[MonthlyPrice]) -> Dict[str, Any]:
+    if not results:
+        return {"error": f"No historical price data found for ENSTRU code {enstru_code}."}
+
+    timeline: Dict[int, Dict[str, Dict[str, Any]]] = {}
+    sample_contract_ids: List[int] = []
+
+    for row in results:
+        year = int(row.year)
+        month = int(row.month)
+        avg_price = round(float(row.avg_price), 2)
+
+        if year not in timeline:
+            timeline[year] = {}
+
+        timeline[year][f"Month_{month}"] = {
+            "average_price": avg_price,
+            "purchase_count": int(row.purchase_count),
+        }
+
+        if row.sample_contract_id:
+            sample_contract_ids.append(int(row.sample_contract_id))
+
+    # Use up to 5 example contracts as direct links for the LLM.
+    unique_ids = list(dict.fromkeys(sample_contract_ids))[:5]
+    top_k_links = contract_links(unique_ids)
+
+    return {
+        "enstru_code": enstru_code,
+        "analysis_type": "price_dynamics_and_seasonality",
+        "timeline": timeline,
+        "top_k_links": top_k_links,
+        "note_to_llm": (
+            "Use this chronological data to calculate inflation percentages between years "
+            "and identify seasonal price spikes in specific months. When giving example links, "
+            "ONLY use the provided 'top_k_links' and do not fabricate generic URLs."
+        ),
+    }
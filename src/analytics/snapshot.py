@@ -0,0 +1,153 @@
+"""
+Read side of the columnar price snapshot written by src.etl.price_snapshot.
+
+Every contract unit with a KTRU code is one row of a set of .npy columns,
+sorted by code and unit id; offsets.npy holds where each code's rows start.
+The columns are memory-mapped read-only, so all API worker processes share
+one copy in the page cache, and a price tool reads only its code's slice.
+Code, KATO and customer strings are stored once in dictionaries.json.
+
+The functions mirror the pandas reference implementations in engine.py.
+"""
+import os
+import json
+import math
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Dict, Optional
+from src.config import PRICE_SNAPSHOT_DIR
+from src.analytics.results import (
+    PriceDeviationResult, VolumeAnomalyResult, FairPriceResult, MonthlyPrice,
+    price_deviation_result, fair_price_result, volume_anomaly_result, price_dynamics_result,
+)
+
+# column -> dtype; -1 and NaN/NaT stand for NULL
+COLUMNS = {
+    'enstru': np.int32,
+    'kato': np.int32,
+    'customer': np.int32,
+    'crdate': 'datetime64[s]',
+    'price': np.float64,
+    'quantity': np.float64,
+    'contract_id': np.int64,
+}
+OFFSETS = 'offsets.npy'
+DICTIONARIES = 'dictionaries.json'
+# symlink to the snapshot in use, replaced atomically by the builder
+CURRENT = 'current'
+
+def _contract_ids(ids: np.ndarray) -> list:
+    return list(dict.fromkeys(int(i) if i >= 0 else None for i in ids))
+
+class PriceSnapshot:
+    def __init__(self, path: str):
+        self.path = path
+        self.columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+        self.offsets = np.load(os.path.join(path, OFFSETS), mmap_mode='r')
+        with open(os.path.join(path, DICTIONARIES), encoding='utf-8') as f:
+            dictionaries = json.load(f)
+        # when the builder read the units
+        self.built_at = datetime.fromisoformat(dictionaries['built_at'])
+        self.codes = {code: i for i, code in enumerate(dictionaries['enstru'])}
+        self.katos = {kato: i for i, kato in enumerate(dictionaries['kato'])}
+        self.customers = {customer_bin: i for i, customer_bin in enumerate(dictionaries['customer'])}
+
+    def has(self, enstru_code: str) -> bool:
+        return enstru_code in self.codes
+
+    def units(self, enstru_code: str) -> Dict[str, np.ndarray]:
+        # views into the mapped columns, nothing is copied
+        i = self.codes[enstru_code]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {name: column[start:end] for name, column in self.columns.items()}
+
+    def check_price_deviation(self, enstru_code: str, target_price: float) -> Optional[PriceDeviationResult]:
+        units = self.units(enstru_code)
+        mask = ~np.isnan(units['price']) & ~np.isnan(units['quantity'])
+        if not mask.any():
+            return None
+
+        price, quantity = units['price'][mask], units['quantity'][mask]
+        # stable sort keeps unit order among equal prices, like nlargest
+        top_k = np.argsort(-price, kind='stable')[:3]
+        return price_deviation_result(
+            enstru_code, target_price, float((price * quantity).sum()), float(quantity.sum()), int(mask.sum()),
+            _contract_ids(units['contract_id'][mask][top_k])
+        )
+
+    def get_fair_price_bounds(self, enstru_code: str, kato_code: Optional[str] = None, year_filter: Optional[int] = None) -> Optional[FairPriceResult]:
+        units = self.units(enstru_code)
+        mask = ~np.isnan(units['price']) & (units['contract_id'] >= 0)
+        if kato_code:
+            mask &= units['kato'] == self.katos.get(kato_code, -2)
+        if year_filter:
+            crdate = units['crdate']
+            mask &= ~np.isnat(crdate) & (crdate.astype('datetime64[Y]').astype(np.int64) + 1970 == year_filter)
+        if mask.sum() < 3:
+            return None
+
+        price = units['price'][mask]
+        q1, q3 = np.quantile(price, [0.25, 0.75])
+        # the mean of the middle values like pandas' median, not the interpolated 0.5 quantile
+        median = np.median(price)
+        median_examples = np.argsort(np.abs(price - median), kind='stable')[:3]
+        return fair_price_result(
+            enstru_code, kato_code, year_filter, len(price), q1, median, q3,
+            _contract_ids(units['contract_id'][mask][median_examples])
+        )
+
+    def detect_volume_anomaly(self, customer_bin: str, enstru_code: str) -> Optional[VolumeAnomalyResult]:
+        units = self.units(enstru_code)
+        mask = (units['customer'] == self.customers.get(customer_bin, -2)) & ~np.isnat(units['crdate'])
+        if not mask.any():
+            return None
+
+        years = units['crdate'][mask].astype('datetime64[Y]').astype(np.int64) + 1970
+        yearly, index = np.unique(years, return_inverse=True)
+        totals = np.bincount(index, weights=np.nan_to_num(units['quantity'][mask]))
+        latest = np.full(len(yearly), -1, dtype=np.int64)
+        np.maximum.at(latest, index, units['contract_id'][mask])
+
+        yearly_vols = {int(year): float(total) for year, total in zip(yearly, totals)}
+        return volume_anomaly_result(customer_bin, enstru_code, yearly_vols, [int(i) for i in latest if i > 0])
+
+    def analyze_price_dynamics(self, enstru_code: str) -> dict:
+        units = self.units(enstru_code)
+        crdate = units['crdate']
+        mask = (units['contract_id'] >= 0) & ~np.isnat(crdate) & (units['price'] > 0)
+
+        months, index = np.unique(crdate[mask].astype('datetime64[M]').astype(np.int64), return_inverse=True)
+        counts = np.bincount(index, minlength=len(months))
+        # exactly rounded sums, PostgreSQL averages the numeric prices without float error
+        by_month = np.split(units['price'][mask][np.argsort(index, kind='stable')], np.cumsum(counts)[:-1])
+        sums = [math.fsum(prices) for prices in by_month]
+        latest = np.full(len(months), -1, dtype=np.int64)
+        np.maximum.at(latest, index, units['contract_id'][mask])
+
+        return price_dynamics_result(enstru_code, [
+            MonthlyPrice(int(m // 12 + 1970), int(m % 12 + 1), total / count, int(count), int(sample))
+            for m, total, count, sample in zip(months, sums, counts, latest)
+        ])
+
+_current: Optional[PriceSnapshot] = None
+_lock = threading.Lock()
+
+def current_snapshot() -> Optional[PriceSnapshot]:
+    """
+    The snapshot PRICE_SNAPSHOT_DIR points to, None when unset or not built
+    yet. Checks the link on every call and maps a new snapshot once the
+    builder has swapped it in.
+    """
+    global _current
+    if not PRICE_SNAPSHOT_DIR:
+        return None
+    try:
+        path = os.path.join(PRICE_SNAPSHOT_DIR, os.readlink(os.path.join(PRICE_SNAPSHOT_DIR, CURRENT)))
+    except OSError:
+        return None
+    if _current is None or _current.path != path:
+        with _lock:
+            if _current is None or _current.path != path:
+                _current = PriceSnapshot(path)
+    return _current
@@ -0,0 +1,79 @@
+"""
+The price statistics of engine.py computed inside PostgreSQL. Every query
+returns at most three rows (the example contracts) carrying the aggregates,
+instead of every matching unit. Ties between examples are broken by unit id,
+like the pandas reference implementation.
+"""
+from typing import Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import Float, cast, func, select, true
+from src.db.models import Contract, ContractUnit, PlanPoint
+from src.analytics.results import PriceDeviationResult, FairPriceResult, price_deviation_result, fair_price_result
+
+def check_price_deviation_sql(db: Session, enstru_code: str, target_price: float) -> Optional[PriceDeviationResult]:
+    # window aggregates over all matching units, attached to the three highest priced ones
+    rows = db.query(
+        ContractUnit.contract_id,
+        func.sum(ContractUnit.item_price * ContractUnit.quantity).over().label('total_value'),
+        func.sum(ContractUnit.quantity).over().label('total_quantity'),
+        func.count().over().label('units'),
+    ).join(
+        PlanPoint, ContractUnit.pln_point_id == PlanPoint.id
+    ).filter(
+        PlanPoint.ref_enstru_code == enstru_code,
+        ContractUnit.item_price != None,
+        ContractUnit.quantity != None
+    ).order_by(
+        ContractUnit.item_price.desc(), ContractUnit.id
+    ).limit(3).all()
+
+    if not rows:
+        return None
+
+    first = rows[0]
+    return price_deviation_result(
+        enstru_code, target_price, float(first.total_value), float(first.total_quantity), first.units,
+        list(dict.fromkeys(row.contract_id for row in rows))
+    )
+
+def get_fair_price_bounds_sql(db: Session, enstru_code: str, kato_code: Optional[str] = None, year_filter: Optional[int] = None) -> Optional[FairPriceResult]:
+    units = select(
+        ContractUnit.id, ContractUnit.item_price.label('price'), ContractUnit.contract_id
+    ).join(
+        PlanPoint, ContractUnit.pln_point_id == PlanPoint.id
+    ).join(
+        Contract, ContractUnit.contract_id == Contract.id
+    ).where(
+        PlanPoint.ref_enstru_code == enstru_code,
+        ContractUnit.item_price != None
+    )
+
+    if kato_code:
+        units = units.where(PlanPoint.kato_code == kato_code)
+    if year_filter:
+        units = units.where(func.extract('year', Contract.crdate) == year_filter)
+    units = units.cte('units')
+
+    # percentile_cont interpolates linearly like pandas' quantile, both on float64
+    price = cast(units.c.price, Float)
+    stats = select(
+        func.count().label('n'),
+        func.percentile_cont(0.25).within_group(price).label('q1'),
+        func.percentile_cont(0.5).within_group(price).label('median'),
+        func.percentile_cont(0.75).within_group(price).label('q3'),
+    ).cte('stats')
+
+    ranked = select(
+        stats, units.c.contract_id,
+        func.row_number().over(order_by=(func.abs(units.c.price - stats.c.median), units.c.id)).label('rank'),
+    ).select_from(units.join(stats, true())).subquery()
+
+    rows = db.execute(select(ranked).where(ranked.c.rank <= 3).order_by(ranked.c.rank)).all()
+    if not rows:
+        return None
+
+    first = rows[0]
+    return fair_price_result(
+        enstru_code, kato_code, year_filter, first.n, first.q1, first.median, first.q3,
+        list(dict.fromkeys(row.contract_id for row in rows))
+    )
@@ -7,4 +7,26 @@ API_TOKEN = os.getenv("API_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 if not API_TOKEN or not DATABASE_URL:
-    raise ValueError("Missing API_TOKEN or DATABASE_URL!")
\ No newline at end of file
+    raise ValueError("Missing API_TOKEN or DATABASE_URL!")
+
+# OWS v3 allows 5 requests per second per token
+OWS_RATE_LIMIT = float(os.getenv("OWS_RATE_LIMIT", "5"))
+OWS_RATE_BURST = int(os.getenv("OWS_RATE_BURST", "5"))
+OWS_MAX_CONCURRENCY = int(os.getenv("OWS_MAX_CONCURRENCY", "8"))
+
+# number of BINs processed in parallel by the loaders
+ETL_WORKERS = int(os.getenv("ETL_WORKERS", "4"))
+
+# on-disk OWS response cache: off | on | record | replay
+OWS_CACHE_MODE = os.getenv("OWS_CACHE_MODE", "off")
+OWS_CACHE_DIR = os.getenv("OWS_CACHE_DIR", ".ows_cache")
+OWS_CACHE_MAX_MB = int(os.getenv("OWS_CACHE_MAX_MB", "2048"))
+
+# run reports (JSON) and Prometheus textfile metrics written at the end of ETL jobs
+ETL_REPORT_DIR = os.getenv("ETL_REPORT_DIR", "etl_reports")
+
+# live price statistics for codes not precomputed: sql (aggregated in PostgreSQL) | pandas (reference)
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "sql")
+
+# memory-mapped price snapshot shared by the API workers, unset keeps the tools on PostgreSQL
+PRICE_SNAPSHOT_DIR = os.getenv("PRICE_SNAPSHOT_DIR")
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, BigInteger, String, Numeric, DateTime, ForeignKey, Integer, Boolean
+from sqlalchemy import Column, BigInteger, String, Numeric, DateTime, ForeignKey, Integer, Boolean, Float
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -135,4 +136,123 @@ class ContractUnit(Base):
     total_sum = Column(Numeric)
     
     contract = relationship("Contract", back_populates="units")
-    plan_point = relationship("PlanPoint", back_populates="units")
\ No newline at end of file
+    plan_point = relationship("PlanPoint", back_populates="units")
+
+class SyncState(Base):
+    """
+    Progress of one paginated ETL stream, e.g. (BIN, 'plans').
+    Written in the same transaction as the rows it covers.
+    """
+    __tablename__ = 'etl_sync_state'
+
+    scope = Column(String, primary_key=True)
+    stream = Column(String, primary_key=True)
+
+    next_page = Column(String)
+    pages_done = Column(Integer, default=0)
+    completed = Column(Boolean, default=False)
+    # newest index_date already ingested by sync_daily
+    watermark = Column(DateTime)
+    # content hash of the last applied reference dictionary
+    digest = Column(String)
+    # consecutive failed runs of a scheduler stage, not run again before retry_after
+    failures = Column(Integer, default=0)
+    retry_after = Column(DateTime)
+    updated_at = Column(DateTime)
+
+class LookupFailure(Base):
+    """
+    Enrichment lookups that failed (e.g. ('enstru', code)), skipped until retry_after.
+    """
+    __tablename__ = 'etl_lookup_failures'
+
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+
+    attempts = Column(Integer, default=1)
+    last_error = Column(String)
+    retry_after = Column(DateTime, index=True)
+    updated_at = Column(DateTime)
+
+class DeadLetter(Base):
+    """
+    Sub-resource fetches (lots of an announcement, units of a contract) that
+    failed while their parent row was stored. Written in the parent's
+    transaction and retried by replay_dead_letters.
+    """
+    __tablename__ = 'etl_dead_letters'
+
+    # e.g. '/v3/contract/123/units', one letter per sub-resource
+    path = Column(String, primary_key=True)
+    entity = Column(String, index=True)
+    parent_id = Column(BigInteger)
+    # BIN the parent was loaded for, lots carry it as customer_bin
+    bin = Column(String)
+
+    attempts = Column(Integer, default=1)
+    last_error = Column(String)
+    retry_after = Column(DateTime, index=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+class EnstruPriceStats(Base):
+    """
+    Precomputed contract unit price statistics per KTRU code, for the whole
+    history and per KATO and contract year ('' and 0 mean all). Stale while
+    the code is queued in enstru_price_stale, recomputed by refresh_price_stats.
+    """
+    __tablename__ = 'enstru_price_stats'
+
+    enstru_code = Column(String, primary_key=True)
+    kato_code = Column(String, primary_key=True, default='')
+    year = Column(Integer, primary_key=True, default=0)
+
+    # check_price_deviation: units with price and quantity
+    weighted_value = Column(Float)
+    weighted_quantity = Column(Float)
+    weighted_units = Column(Integer)
+    top_contract_ids = Column(ARRAY(BigInteger))
+
+    # get_fair_price_bounds: units with a price
+    price_count = Column(Integer)
+    q1 = Column(Float)
+    median = Column(Float)
+    q3 = Column(Float)
+    median_contract_ids = Column(ARRAY(BigInteger))
+
+    updated_at = Column(DateTime)
+
+class EnstruPriceStale(Base):
+    """
+    KTRU codes whose units were written since their statistics were computed.
+    Append-only for the loaders, so concurrent BIN workers never wait on each
+    other; refresh_price_stats deletes the entries of the codes it recomputes.
+    """
+    __tablename__ = 'enstru_price_stale'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    enstru_code = Column(String, index=True)
+    marked_at = Column(DateTime)
+
+class Anomaly(Base):
+    """
+    Findings of the nightly anomaly scan, one per customer BIN, KTRU code and
+    kind of check. Replaced partition by partition on every run; the primary
+    key serves the per-BIN lookups of the agent.
+    """
+    __tablename__ = 'anomalies'
+
+    customer_bin = Column(String, primary_key=True)
+    enstru_code = Column(String, primary_key=True, index=True)
+    # price_deviation | fair_price | volume
+    kind = Column(String, primary_key=True)
+
+    # deviation from the reference in percent
+    score = Column(Float)
+    # the customer's weighted average price, median price or latest yearly volume
+    value = Column(Float)
+    # market weighted average, exceeded fair price bound or historical yearly average
+    reference = Column(Float)
+    description = Column(String)
+    contract_ids = Column(ARRAY(BigInteger))
+    detected_at = Column(DateTime)
@@ -0,0 +1,174 @@
+import os
+import time
+import argparse
+import logging
+import multiprocessing
+import pandas as pd
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.config import ETL_REPORT_DIR
+from src.db.session import SessionLocal
+from src.db.models import Anomaly, Contract, ContractUnit, PlanPoint
+from src.analytics.engine import deviation_from_stats, fair_price_from_stats
+from src.analytics.price_stats import EXAMPLES, stats_many
+from src.analytics.results import volume_anomaly_result, volume_growth
+from src.etl.metrics import metrics
+from src.etl.price_stats import all_codes
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PRICE_DEVIATION = 'price_deviation'
+FAIR_PRICE = 'fair_price'
+VOLUME = 'volume'
+
+# KTRU codes sharing the first characters are scanned and replaced together
+PREFIX_LENGTH = 2
+INSERT_CHUNK = 1000
+
+PAIR = ['enstru_code', 'customer_bin']
+
+def partition_frame(db: Session, codes: List[str]) -> pd.DataFrame:
+    # every unit of the codes, customer and year from its contract, in unit order
+    rows = db.execute(
+        select(
+            PlanPoint.ref_enstru_code, Contract.customer_bin, func.extract('year', Contract.crdate),
+            ContractUnit.item_price, ContractUnit.quantity, ContractUnit.contract_id,
+        )
+        .join(PlanPoint, ContractUnit.pln_point_id == PlanPoint.id)
+        .outerjoin(Contract, ContractUnit.contract_id == Contract.id)
+        .where(PlanPoint.ref_enstru_code.in_(codes))
+        .order_by(ContractUnit.id)
+    ).all()
+    df = pd.DataFrame(rows, columns=['enstru_code', 'customer_bin', 'year', 'price', 'quantity', 'contract_id'])
+    for column in ('year', 'price', 'quantity', 'contract_id'):
+        df[column] = pd.to_numeric(df[column])
+    return df
+
+def _priciest_contracts(units: pd.DataFrame) -> pd.Series:
+    ranked = units.sort_values('price', ascending=False, kind='stable').groupby(PAIR, sort=False).head(EXAMPLES)
+    return ranked.groupby(PAIR, sort=False)['contract_id'].agg(lambda ids: list(dict.fromkeys(int(i) for i in ids)))
+
+def _percent(value: float, reference: float) -> float:
+    return (value - reference) / reference * 100
+
+def find_anomalies(df: pd.DataFrame, stats: Dict, detected_at: datetime) -> List[dict]:
+    """
+    The checks of engine.py for every (code, customer) pair in `df`, with
+    `stats` the market statistics per code from stats_many. The customer's
+    own prices are the targets: their weighted average for the deviation from
+    the market, their median unit price for the fair price bounds.
+    """
+    found = []
+
+    def add(code, customer_bin, kind, score, value, reference, description, contract_ids):
+        found.append(dict(
+            customer_bin=customer_bin, enstru_code=code, kind=kind, score=float(score), value=float(value),
+            reference=float(reference), description=description, contract_ids=contract_ids, detected_at=detected_at,
+        ))
+
+    bought = df[df['customer_bin'].notna()]
+    priced = bought[bought['price'].notna()]
+    examples = _priciest_contracts(priced) if not priced.empty else pd.Series(dtype=object)
+
+    weighted = priced[priced['quantity'].notna()]
+    pairs = weighted.assign(value=weighted['price'] * weighted['quantity']).groupby(PAIR).agg(
+        spent=('value', 'sum'), quantity=('quantity', 'sum'),
+    )
+    for (code, customer_bin), pair in pairs[pairs['quantity'] != 0].iterrows():
+        res = deviation_from_stats(code, pair.spent / pair.quantity, stats[code]) if stats.get(code) is not None else None
+        if res is not None and res.is_anomalous:
+            add(code, customer_bin, PRICE_DEVIATION, res.deviation_percentage, res.target_price, res.weighted_average_price,
+                f"Weighted average price {res.target_price:.2f} deviates {res.deviation_percentage:+.1f}% from the market ({res.weighted_average_price:.2f}).",
+                examples.get((code, customer_bin), []))
+
+    for (code, customer_bin), median in priced.groupby(PAIR)['price'].median().items():
+        fair = fair_price_from_stats(code, None, None, stats[code]) if stats.get(code) is not None else None
+        if fair is None or fair.fair_min <= median <= fair.fair_max:
+            continue
+        bound = fair.fair_max if median > fair.fair_max else fair.fair_min
+        add(code, customer_bin, FAIR_PRICE, _percent(median, bound), median, bound,
+            f"Median price {median:.2f} is outside the fair range {fair.fair_min:.2f} - {fair.fair_max:.2f}.",
+            examples.get((code, customer_bin), []))
+
+    yearly = bought[bought['year'].notna()].groupby([*PAIR, 'year']).agg(
+        quantity=('quantity', 'sum'), latest_contract_id=('contract_id', 'max'),
+    )
+    for (code, customer_bin), years in yearly.groupby(level=[0, 1]):
+        if len(years) < 2:
+            continue
+        yearly_vols = {int(year): float(row.quantity) for (_, _, year), row in years.iterrows()}
+        sample_ids = [int(i) for i in years['latest_contract_id'].dropna()]
+        res = volume_anomaly_result(customer_bin, code, yearly_vols, sample_ids)
+        if res.is_anomalous:
+            _, latest_vol, hist_avg = volume_growth(yearly_vols)
+            add(code, customer_bin, VOLUME, _percent(latest_vol, hist_avg), latest_vol, hist_avg, res.description, sample_ids[-3:])
+
+    return found
+
+def scan_partition(prefix: str, codes: List[str], detected_at: datetime) -> Counter:
+    # runs in a pool process with its own connection, replaces the partition's anomalies in one transaction
+    db = SessionLocal()
+    try:
+        rows = find_anomalies(partition_frame(db, codes), stats_many(db, codes), detected_at)
+        db.query(Anomaly).filter(
+            func.substr(Anomaly.enstru_code, 1, PREFIX_LENGTH) == prefix
+        ).delete(synchronize_session=False)
+        for start in range(0, len(rows), INSERT_CHUNK):
+            db.execute(insert(Anomaly.__table__).values(rows[start:start + INSERT_CHUNK]))
+        db.commit()
+        return Counter(row['kind'] for row in rows)
+    finally:
+        db.close()
+
+def scan_anomalies(db: Session, workers: int = None):
+    """Runs the anomaly checks over every (code, customer) pair and replaces the anomalies table."""
+    workers = workers or os.cpu_count() or 1
+    started = time.monotonic()
+    detected_at = datetime.now()
+
+    partitions: Dict[str, List[str]] = {}
+    for code in all_codes(db):
+        partitions.setdefault(code[:PREFIX_LENGTH], []).append(code)
+    # anomalies of prefixes without units any more
+    db.query(Anomaly).filter(
+        func.substr(Anomaly.enstru_code, 1, PREFIX_LENGTH).notin_(list(partitions))
+    ).delete(synchronize_session=False)
+    db.commit()
+
+    logger.info(f"Scanning {sum(map(len, partitions.values()))} KTRU codes in {len(partitions)} partitions with {workers} processes")
+    found = Counter()
+    # spawned, not forked: the scheduler runs stages from threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # the largest partitions first, so none is left running alone at the end
+        futures = {
+            pool.submit(scan_partition, prefix, codes, detected_at): prefix
+            for prefix, codes in sorted(partitions.items(), key=lambda p: -len(p[1]))
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            counts = future.result()
+            found.update(counts)
+            for kind, count in counts.items():
+                metrics.inc('etl_anomalies_total', count, kind=kind)
+            logger.info(f"Partition {futures[future]} done ({done}/{len(futures)}), {sum(counts.values())} anomalies")
+
+    metrics.observe('etl_anomaly_scan_seconds', time.monotonic() - started)
+    summary = ', '.join(f"{count} {kind}" for kind, count in sorted(found.items())) or "none"
+    logger.info(f"Anomaly scan complete in {time.monotonic() - started:.1f}s: {summary}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan every KTRU code and customer BIN for price and volume anomalies")
+    parser.add_argument('--workers', type=int, default=None, help="scanner processes, defaults to the CPU count")
+    args = parser.parse_args()
+
+    db_session = SessionLocal()
+    try:
+        scan_anomalies(db_session, args.workers)
+    finally:
+        db_session.close()
+        metrics.write_report(ETL_REPORT_DIR, 'anomaly_scan')
@@ -0,0 +1,146 @@
+import time
+import asyncio
+import httpx
+import logging
+from typing import AsyncIterator
+from src.config import API_TOKEN, OWS_MAX_CONCURRENCY
+from src.etl.client import Page, extract_items, next_page_token
+from src.etl.decoders import json_loads
+from src.etl.http_cache import ResponseCache, response_cache
+from src.etl.metrics import metrics, endpoint
+from src.etl.ratelimit import TokenBucket, shared_bucket
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class AsyncGoszakupClient:
+    """
+    asyncio counterpart of GoszakupClient. Up to `max_concurrency` requests are
+    in flight at once, all of them paced by one shared token bucket.
+    """
+    def __init__(self, base_url: str = 'https://ows.goszakup.gov.kz',
+                 max_concurrency: int = OWS_MAX_CONCURRENCY,
+                 rate_limiter: TokenBucket = None,
+                 cache: ResponseCache = response_cache):
+        self.base_url = base_url.rstrip('/')
+        self.rate_limiter = rate_limiter or shared_bucket
+        self.cache = cache
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = httpx.AsyncClient(
+            headers={
+                'Authorization': f'Bearer {API_TOKEN}',
+                'Content-Type': 'application/json',
+            },
+            timeout=90,
+            limits=httpx.Limits(max_connections=max_concurrency),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def get(self, path: str, params: dict = None, max_retries: int = 4) -> dict:
+        url = f'{self.base_url}{path}'
+        name = endpoint(path)
+        if self.cache:
+            cached = self.cache.get(path, params)
+            if cached is not None:
+                metrics.inc('ows_cache_hits_total', endpoint=name)
+                return cached
+
+        async with self.semaphore:
+            for attempt in range(max_retries):
+                if attempt:
+                    metrics.inc('ows_retries_total', endpoint=name)
+                await self.rate_limiter.acquire_async()
+                started = time.perf_counter()
+                try:
+                    response = await self.session.get(url, params=params)
+                    metrics.observe('ows_request_seconds', time.perf_counter() - started, endpoint=name)
+                    metrics.inc('ows_requests_total', endpoint=name, status=str(response.status_code))
+
+                    if response.status_code == 429:
+                        # pause the whole pool, the quota is per token
+                        metrics.inc('ows_throttled_total', endpoint=name)
+                        self.rate_limiter.penalize(2 ** attempt * 5)
+                        continue
+
+                    response.raise_for_status()
+                    metrics.inc('ows_response_bytes_total', len(response.content), endpoint=name)
+                    data = json_loads(response.content)
+                    if self.cache:
+                        self.cache.put(path, params, response.content)
+                    return data
+
+                except httpx.HTTPError as e:
+                    # unknown ids and bad requests do not get better with retries
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.is_client_error:
+                        raise
+                    if not isinstance(e, httpx.HTTPStatusError):
+                        metrics.inc('ows_requests_total', endpoint=name, status='error')
+                    logger.error(f"Request failed: {e}. Retrying...")
+                    await asyncio.sleep(2 ** attempt * 3)
+                except ValueError as e:
+                    # truncated or HTML body behind a 200, retried like a failed request
+                    logger.error(f"Invalid JSON from {url}: {e}. Retrying...")
+                    await asyncio.sleep(2 ** attempt * 3)
+
+        raise RuntimeError(f"Failed to fetch {url} after {max_retries} retries.")
+
+    async def iter_pages(self, path: str, params: dict = None, max_pages: int = None,
+                         next_page: str = None) -> AsyncIterator[Page]:
+        params = (params or {}).copy()
+        if 'limit' not in params:
+            params['limit'] = 1000
+        if next_page:
+            params['next_page'] = next_page
+
+        page = 1
+        seen_ids = set()
+
+        while True:
+            logger.info(f"Fetching page {page} from {path}...")
+            data = await self.get(path, params)
+
+            items = extract_items(data)
+
+            if not items:
+                break
+
+            new_items = []
+            for item in items:
+                item_id = item.get('id')
+                if item_id and item_id in seen_ids:
+                    continue
+
+                if item_id:
+                    seen_ids.add(item_id)
+
+                new_items.append(item)
+
+            if not new_items:
+                logger.warning(f"API returned redundant data at page {page}. Breaking infinite loop.")
+                break
+
+            next_page = next_page_token(data, params)
+            yield Page(new_items, next_page, page)
+
+            if max_pages and page >= max_pages:
+                logger.info(f"Reached max_pages limit ({max_pages}). Stopping.")
+                break
+
+            if not next_page:
+                break
+
+            params['next_page'] = next_page
+            page += 1
+
+    async def paginate(self, path: str, params: dict = None, max_pages: int = None) -> AsyncIterator[dict]:
+        async for page in self.iter_pages(path, params, max_pages):
+            for item in page.items:
+                yield item
@@ -0,0 +1,200 @@
+import io
+import csv
+import time
+import logging
+from typing import Dict, Iterable, List, Set
+from sqlalchemy import column, select, table
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.db.models import RefUnit, PlanPoint, Announcement, Lot, Contract, ContractUnit, DeadLetter
+from src.etl.metrics import metrics
+from src.etl.price_stats import mark_stale, codes_of_plans
+from src.etl.subjects import subject_registry
+
+logger = logging.getLogger(__name__)
+
+# parents first, so every FK target is written before the rows pointing at it;
+# subjects come from the subject registry, which is flushed before all of these;
+# dead letters go with the parent rows whose sub-resources failed
+FLUSH_ORDER = [RefUnit, PlanPoint, Announcement, Lot, Contract, ContractUnit, DeadLetter]
+
+CONFLICT_KEYS = {
+    RefUnit: 'code',
+    DeadLetter: 'path',
+}
+
+# never overwritten, ref_units may hold placeholders for codes missing from the dictionary
+KEEP_EXISTING = (RefUnit,)
+
+# nullable references whose target may not be stored (outside the load window, never
+# published); checked against the table at flush time and set to NULL when missing
+OPTIONAL_REFS = {
+    Contract: ('trd_buy_id', Announcement),
+    ContractUnit: ('pln_point_id', PlanPoint),
+}
+
+def existing_ids(db: Session, model, ids: Iterable) -> Set:
+    """Which of `ids` are already stored, one indexed lookup instead of a table-wide id set."""
+    ids = {i for i in ids if i is not None}
+    if not ids:
+        return set()
+    key = getattr(model, CONFLICT_KEYS.get(model, 'id'))
+    return set(db.scalars(select(key).where(key.in_(ids))))
+
+class BulkWriter:
+    """
+    Buffers decoded rows per table and writes them as multi-row
+    INSERT ... ON CONFLICT statements instead of one round trip per record.
+
+    update=False keeps existing rows (ON CONFLICT DO NOTHING),
+    update=True overwrites them like session.merge (ON CONFLICT DO UPDATE).
+    """
+    def __init__(self, db: Session, update: bool = False, batch_size: int = 1000):
+        self.db = db
+        self.update = update
+        self.batch_size = batch_size
+        self.buffers: Dict[type, Dict] = {model: {} for model in FLUSH_ORDER}
+        self.pending = 0
+        self.written: Dict[str, int] = {}
+
+    def add(self, model, row: dict):
+        # keyed by the conflict column, one statement must not touch a row twice
+        key = row[CONFLICT_KEYS.get(model, 'id')]
+        if key is None:
+            return
+        buffer = self.buffers[model]
+        if key not in buffer:
+            self.pending += 1
+        buffer[key] = row
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        subject_registry.flush(self.db)
+        if not self.pending:
+            return
+        for model in FLUSH_ORDER:
+            rows = list(self.buffers[model].values())
+            if not rows:
+                continue
+            started = time.perf_counter()
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                if model in OPTIONAL_REFS:
+                    self._drop_missing_refs(model, batch)
+                self._insert(model, batch)
+                if model is ContractUnit:
+                    mark_stale(self.db, codes_of_plans({row['pln_point_id'] for row in batch if row['pln_point_id']}))
+            self.buffers[model].clear()
+            name = model.__tablename__
+            self.written[name] = self.written.get(name, 0) + len(rows)
+            metrics.observe('etl_flush_seconds', time.perf_counter() - started, table=name)
+            metrics.inc('etl_rows_written_total', len(rows), table=name)
+        self.pending = 0
+
+    def _drop_missing_refs(self, model, rows: List[dict]):
+        # parents are flushed first, so rows referencing this batch's parents resolve
+        column, target = OPTIONAL_REFS[model]
+        stored = existing_ids(self.db, target, (row[column] for row in rows))
+        for row in rows:
+            if row[column] is not None and row[column] not in stored:
+                row[column] = None
+
+    def _insert(self, model, rows: List[dict]):
+        key = CONFLICT_KEYS.get(model, 'id')
+        stmt = insert(model.__table__).values(rows)
+        if self.update and model not in KEEP_EXISTING:
+            columns = [c for c in rows[0] if c != key]
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[key],
+                set_={c: stmt.excluded[c] for c in columns},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+        self.db.execute(stmt)
+
+class CopyWriter:
+    """
+    Backfill counterpart of BulkWriter for seeding empty environments.
+
+    Rows are streamed with COPY into per-connection staging tables (TEMP,
+    so never WAL-logged) and merged into the real tables with one
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING per table. Missing optional
+    references (OPTIONAL_REFS) are nulled by the same statement.
+    """
+    def __init__(self, db: Session, batch_size: int = 50000):
+        self.db = db
+        self.batch_size = batch_size
+        self.buffers: Dict[type, Dict] = {model: {} for model in FLUSH_ORDER}
+        self.pending = 0
+        self.written: Dict[str, int] = {}
+
+    def add(self, model, row: dict):
+        key = row[CONFLICT_KEYS.get(model, 'id')]
+        if key is None:
+            return
+        buffer = self.buffers[model]
+        if key not in buffer:
+            self.pending += 1
+        buffer[key] = row
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        subject_registry.flush(self.db)
+        if not self.pending:
+            return
+        cursor = self.db.connection().connection.cursor()
+        try:
+            for model in FLUSH_ORDER:
+                rows = list(self.buffers[model].values())
+                if not rows:
+                    continue
+                started = time.perf_counter()
+                stage = f'etl_stage_{model.__tablename__}'
+                columns = [c.name for c in model.__table__.columns if c.name in rows[0]]
+                # the pooled connection may change between transactions, the table is created on demand
+                cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {model.__tablename__} INCLUDING DEFAULTS)')
+                cursor.execute(f'TRUNCATE {stage}')
+                cursor.copy_expert(f"COPY {stage} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", self._csv(rows, columns))
+                cursor.execute(self._merge_sql(model, stage, columns))
+                written = cursor.rowcount
+                if model is ContractUnit:
+                    staged = table(stage, column('pln_point_id'))
+                    mark_stale(self.db, select(PlanPoint.ref_enstru_code).distinct().join_from(
+                        staged, PlanPoint, PlanPoint.id == staged.c.pln_point_id
+                    ).where(PlanPoint.ref_enstru_code.isnot(None)))
+                self.buffers[model].clear()
+                name = model.__tablename__
+                self.written[name] = self.written.get(name, 0) + written
+                metrics.observe('etl_flush_seconds', time.perf_counter() - started, table=name)
+                metrics.inc('etl_rows_written_total', written, table=name)
+        finally:
+            cursor.close()
+        self.pending = 0
+
+    @staticmethod
+    def _csv(rows: List[dict], columns: List[str]) -> io.StringIO:
+        # strings are always quoted, so only None becomes an unquoted empty field (NULL)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_STRINGS)
+        for row in rows:
+            writer.writerow([row.get(c) for c in columns])
+        buffer.seek(0)
+        return buffer
+
+    @staticmethod
+    def _merge_sql(model, stage: str, columns: List[str]) -> str:
+        ref_column, target = OPTIONAL_REFS.get(model, (None, None))
+        select_list = []
+        for c in columns:
+            if c == ref_column:
+                select_list.append(f'(SELECT t.id FROM {target.__tablename__} t WHERE t.id = s.{c})')
+            else:
+                select_list.append(f's.{c}')
+        key = CONFLICT_KEYS.get(model, 'id')
+        return (
+            f"INSERT INTO {model.__tablename__} ({', '.join(columns)}) "
+            f"SELECT {', '.join(select_list)} FROM {stage} s "
+            f"ON CONFLICT ({key}) DO NOTHING"
+        )
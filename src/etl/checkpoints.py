@@ -0,0 +1,75 @@
+import logging
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.db.models import SyncState
+from src.etl.client import Page
+
+logger = logging.getLogger(__name__)
+
+class Checkpoint:
+    """
+    Saved pagination position of one (scope, stream), e.g. (BIN, 'contracts').
+
+    `save` is meant to be passed as the pipeline's on_commit, so the token is
+    committed together with the rows of the pages before it and a resumed
+    run continues exactly after the last committed page.
+    """
+    def __init__(self, db: Session, scope: str, stream: str):
+        self.db = db
+        self.scope = scope
+        self.stream = stream
+        state = db.get(SyncState, (scope, stream))
+        self.next_page = state.next_page if state else None
+        self.pages_done = (state.pages_done or 0) if state else 0
+        self.completed = bool(state.completed) if state else False
+        self.base_pages = 0
+
+    def start(self, resume: bool) -> Optional[str]:
+        """Returns the token to start paginating from, None for the first page."""
+        if resume and self.next_page:
+            self.base_pages = self.pages_done
+            logger.info(f"resuming {self.stream} for {self.scope} after page {self.pages_done}")
+            return self.next_page
+        self.base_pages = 0
+        return None
+
+    def save(self, page: Page):
+        self._write(page.next_page, self.base_pages + page.number, completed=page.next_page is None)
+
+    def finish(self):
+        self._write(None, self.pages_done, completed=True)
+
+    def _write(self, next_page: Optional[str], pages_done: int, completed: bool):
+        self.next_page = next_page
+        self.pages_done = pages_done
+        self.completed = completed
+        values = dict(next_page=next_page, pages_done=pages_done, completed=completed, updated_at=datetime.now())
+        stmt = insert(SyncState).values(scope=self.scope, stream=self.stream, **values)
+        self.db.execute(stmt.on_conflict_do_update(index_elements=['scope', 'stream'], set_=values))
+
+def get_watermark(db: Session, scope: str, stream: str) -> Optional[datetime]:
+    state = db.get(SyncState, (scope, stream))
+    return state.watermark if state else None
+
+def set_watermark(db: Session, scope: str, stream: str, watermark: datetime):
+    # never moves backwards, a partial or older run cannot undo progress
+    values = dict(watermark=watermark, updated_at=datetime.now())
+    stmt = insert(SyncState).values(scope=scope, stream=stream, **values)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=['scope', 'stream'],
+        set_=dict(watermark=func.greatest(SyncState.watermark, stmt.excluded.watermark), updated_at=stmt.excluded.updated_at),
+    ))
+
+def get_cursor(db: Session, scope: str, stream: str) -> Optional[str]:
+    """Position of a job that is not paginated over OWS, e.g. a keyset scan of a table."""
+    state = db.get(SyncState, (scope, stream))
+    return state.next_page if state else None
+
+def set_cursor(db: Session, scope: str, stream: str, cursor: Optional[str]):
+    # in the caller's transaction, committed with the rows it covers; None starts over
+    values = dict(next_page=cursor, updated_at=datetime.now())
+    stmt = insert(SyncState).values(scope=scope, stream=stream, **values)
+    db.execute(stmt.on_conflict_do_update(index_elements=['scope', 'stream'], set_=values))
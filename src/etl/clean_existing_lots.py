@@ -1,45 +1,81 @@
+import os
+import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from src.db.session import SessionLocal
 from src.db.models import Lot
-from src.utils.cleaners import sanitize_lot_text
+from src.etl.checkpoints import get_cursor, set_cursor
+from src.utils.cleaners import sanitize_lot_texts
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def clean_database_lots(db: Session):
-    # Iterates through all existing lots and cleans their text fields.
+BATCH_SIZE = 5000
+# the cursor in etl_sync_state is the last cleaned lot id
+CHECKPOINT_SCOPE = 'lots'
+CHECKPOINT_STREAM = 'clean_lots'
+
+def clean_chunk(rows: List[Tuple[int, str]]) -> List[dict]:
+    # runs in a pool process, returns only the rows whose text changes
+    cleaned = sanitize_lot_texts([name_ru for _, name_ru in rows])
+    return [
+        dict(id=lot_id, name_ru=cleaned_ru)
+        for (lot_id, name_ru), cleaned_ru in zip(rows, cleaned)
+        if cleaned_ru != name_ru
+    ]
+
+def clean_database_lots(db: Session, workers: int = None, resume: bool = False):
     logger.info("Starting lot name cleaning")
-    
-    batch_size = 5000
-    offset = 0
+    workers = workers or os.cpu_count() or 1
+    cursor = get_cursor(db, CHECKPOINT_SCOPE, CHECKPOINT_STREAM) if resume else None
+    last_id = int(cursor) if cursor else 0
+    if last_id:
+        logger.info(f"resuming after lot {last_id}")
+
+    scanned = 0
     updated_count = 0
-    
-    while True:
-        # fetching lots in batches
-        lots_batch = db.query(Lot).offset(offset).limit(batch_size).all()
-        if not lots_batch:
-            break
-            
-        for lot in lots_batch:
-            original_ru = lot.name_ru
-            
-            cleaned_ru = sanitize_lot_text(original_ru)
-            
-            # Only update and commit if the text was actually changed
-            if original_ru != cleaned_ru:
-                lot.name_ru = cleaned_ru
-                updated_count += 1
-        
-        db.commit()
-        offset += batch_size
-        logger.info(f"Scanned {offset} lots")
-        
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # keyset pagination: stable order, every page is one index range scan
+            rows = db.query(Lot.id, Lot.name_ru).filter(
+                Lot.id > last_id,
+                Lot.name_ru.isnot(None)
+            ).order_by(Lot.id).limit(BATCH_SIZE).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            rows = [tuple(row) for row in rows]
+            chunk = -(-len(rows) // workers)
+            changed = []
+            for part in pool.map(clean_chunk, (rows[i:i + chunk] for i in range(0, len(rows), chunk))):
+                changed.extend(part)
+
+            if changed:
+                # bulk UPDATE by primary key, executed as one executemany
+                db.execute(update(Lot), changed)
+            set_cursor(db, CHECKPOINT_SCOPE, CHECKPOINT_STREAM, str(last_id))
+            db.commit()
+
+            scanned += len(rows)
+            updated_count += len(changed)
+            logger.info(f"Scanned {scanned} lots up to id {last_id}, {updated_count} updated")
+
+    set_cursor(db, CHECKPOINT_SCOPE, CHECKPOINT_STREAM, None)
+    db.commit()
     logger.info(f"Cleaning Complete. Updated {updated_count} lot names")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sanitize lot names already stored")
+    parser.add_argument('--workers', type=int, default=None, help="sanitizer processes, defaults to the CPU count")
+    parser.add_argument('--resume', action='store_true', help="continue after the last cleaned lot id")
+    args = parser.parse_args()
+
     db_session = SessionLocal()
     try:
-        clean_database_lots(db_session)
+        clean_database_lots(db_session, args.workers, args.resume)
     finally:
-        db_session.close()
\ No newline at end of file
+        db_session.close()
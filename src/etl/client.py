@@ -1,49 +1,103 @@
 import time
 import requests
 import logging
-from typing import Iterator
+from dataclasses import dataclass
+from typing import Iterator, Optional
 from src.config import API_TOKEN
+from src.etl.decoders import json_loads
+from src.etl.http_cache import ResponseCache, response_cache
+from src.etl.metrics import metrics, endpoint
+from src.etl.ratelimit import TokenBucket, shared_bucket
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@dataclass
+class Page:
+    items: list
+    # token that requests the page after this one, None on the last page
+    next_page: Optional[str] = None
+    number: int = 0
+
+def extract_items(data) -> list:
+    return data if isinstance(data, list) else data.get('items', [])
+
+def next_page_token(data, params: dict):
+    # extract next_page token
+    next_page = data.get('next_page') if isinstance(data, dict) else None
+
+    # the token is missing or identical to the one we just requested
+    if not next_page or str(params.get('next_page')) == str(next_page):
+        return None
+    return next_page
+
 class GoszakupClient:
-    def __init__(self, base_url: str = 'https://ows.goszakup.gov.kz'):
+    def __init__(self, base_url: str = 'https://ows.goszakup.gov.kz', rate_limiter: TokenBucket = None,
+                 cache: ResponseCache = response_cache):
         self.session = requests.Session()
         self.session.headers.update({
             'Authorization': f'Bearer {API_TOKEN}',
             'Content-Type': 'application/json',
         })
         self.base_url = base_url.rstrip('/')
-        self.rate_limit_pause = 0.35 
+        # shared across clients so parallel workers stay within one quota
+        self.rate_limiter = rate_limiter or shared_bucket
+        self.cache = cache
 
     def get(self, path: str, params: dict = None, max_retries: int = 4) -> dict:
         url = f'{self.base_url}{path}'
-        time.sleep(self.rate_limit_pause)
+        name = endpoint(path)
+        if self.cache:
+            cached = self.cache.get(path, params)
+            if cached is not None:
+                metrics.inc('ows_cache_hits_total', endpoint=name)
+                return cached
         
         for attempt in range(max_retries):
+            if attempt:
+                metrics.inc('ows_retries_total', endpoint=name)
+            self.rate_limiter.acquire()
+            started = time.perf_counter()
             try:
                 response = self.session.get(url, params=params, timeout=90)
+                metrics.observe('ows_request_seconds', time.perf_counter() - started, endpoint=name)
+                metrics.inc('ows_requests_total', endpoint=name, status=str(response.status_code))
                 
                 if response.status_code == 429:
-                    sleep_time = 2 ** attempt * 5
-                    logger.warning(f"Rate limited (429). Sleeping for {sleep_time}s...")
-                    time.sleep(sleep_time)
+                    metrics.inc('ows_throttled_total', endpoint=name)
+                    self.rate_limiter.penalize(2 ** attempt * 5)
                     continue
                     
                 response.raise_for_status()
-                return response.json()
+                metrics.inc('ows_response_bytes_total', len(response.content), endpoint=name)
+                data = json_loads(response.content)
+                if self.cache:
+                    self.cache.put(path, params, response.content)
+                return data
                 
             except requests.exceptions.RequestException as e:
+                # unknown ids and bad requests do not get better with retries
+                if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500:
+                    raise
+                if e.response is None:
+                    metrics.inc('ows_requests_total', endpoint=name, status='error')
                 logger.error(f"Request failed: {e}. Retrying...")
                 time.sleep(2 ** attempt * 3)
+            except ValueError as e:
+                # truncated or HTML body behind a 200, retried like a failed request
+                logger.error(f"Invalid JSON from {url}: {e}. Retrying...")
+                time.sleep(2 ** attempt * 3)
                 
         raise RuntimeError(f"Failed to fetch {url} after {max_retries} retries.")
 
-    def paginate(self, path: str, params: dict = None, max_pages: int = None) -> Iterator[dict]:
+    def iter_pages(self, path: str, params: dict = None, max_pages: int = None,
+                   next_page: str = None) -> Iterator[Page]:
         params = (params or {}).copy()
         if 'limit' not in params:
             params['limit'] = 1000
+        # resume from a token saved by an earlier run
+        if next_page:
+            params['next_page'] = next_page
             
         page = 1
         seen_ids = set()
@@ -52,12 +106,12 @@ class GoszakupClient:
             logger.info(f"Fetching page {page} from {path}...")
             data = self.get(path, params)
             
-            items = data if isinstance(data, list) else data.get('items', [])
+            items = extract_items(data)
             
             if not items:
                 break
                 
-            new_items_count = 0
+            new_items = []
             for item in items:
                 # skip seen ids
                 item_id = item.get('id')
@@ -67,24 +121,26 @@ class GoszakupClient:
                 if item_id:
                     seen_ids.add(item_id)
                 
-                new_items_count += 1
-                yield item
+                new_items.append(item)
                 
             # if page is seen
-            if new_items_count == 0:
+            if not new_items:
                 logger.warning(f"API returned redundant data at page {page}. Breaking infinite loop.")
                 break
                 
+            next_page = next_page_token(data, params)
+            yield Page(new_items, next_page, page)
+                
             if max_pages and page >= max_pages:
                 logger.info(f"Reached max_pages limit ({max_pages}). Stopping.")
                 break
                 
-            # extract next_page token
-            next_page = data.get('next_page') if isinstance(data, dict) else None
-            
-            # the token is missing or identical to the one we just requested
-            if not next_page or str(params.get('next_page')) == str(next_page):
+            if not next_page:
                 break
                 
             params['next_page'] = next_page
-            page += 1
\ No newline at end of file
+            page += 1
+
+    def paginate(self, path: str, params: dict = None, max_pages: int = None) -> Iterator[dict]:
+        for page in self.iter_pages(path, params, max_pages):
+            yield from page.items
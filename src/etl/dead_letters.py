@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Tuple
+from src.db.models import DeadLetter
+from src.etl.metrics import metrics
+
+LOTS = 'lots'
+CONTRACT_UNITS = 'contract_units'
+
+# replays back off from half an hour, doubling per failed attempt up to a day
+RETRY_FIRST = timedelta(minutes=30)
+RETRY_MAX = timedelta(days=1)
+# letters failing this often are left for inspection, replay --all still tries them
+MAX_ATTEMPTS = 10
+
+@dataclass(frozen=True)
+class FailedFetch:
+    """Returned instead of the items when a sub-resource fetch failed."""
+    path: str
+    error: str
+
+def dead_letter_row(entity: str, parent_id: int, failed: FailedFetch, bin_number: str = None) -> Tuple[type, dict]:
+    """
+    (DeadLetter, row) for the bulk writers, so the letter is committed
+    together with the parent row whose children are missing.
+    """
+    metrics.inc('etl_dead_letters_total', entity=entity)
+    now = datetime.now()
+    return DeadLetter, dict(
+        path=failed.path, entity=entity, parent_id=parent_id, bin=bin_number, attempts=1,
+        last_error=failed.error[:500], retry_after=now, created_at=now, updated_at=now,
+    )
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(RETRY_FIRST * 2 ** (attempts - 1), RETRY_MAX)
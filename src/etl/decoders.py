@@ -0,0 +1,136 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional, Sequence, Tuple
+from src.db.models import PlanPoint, Announcement, Lot, Contract, ContractUnit, Subject
+
+try:
+    import orjson
+    # optional, several times faster on large pages
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+def parse_date(value) -> Optional[datetime]:
+    """
+    Every date format OWS returns: '2024-01-31 10:00:00', '2024-01-31T10:00:00.123',
+    '2024-01-31T10:00:00Z', '2024-01-31T10:00:00+05:00' and '2024-01-31'.
+    Offsets are dropped, the wall-clock time is kept.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None) if value.tzinfo else value
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+    return parsed.replace(tzinfo=None) if parsed.tzinfo else parsed
+
+def blank_to_none(value):
+    return value if value and str(value).strip() else None
+
+def zero_to_none(value):
+    return value if value else None
+
+def first_kato(value):
+    return value[0].get('ref_kato_code') if value else None
+
+@dataclass(frozen=True)
+class Field:
+    column: str
+    # key in the OWS item, the column name by default
+    key: Optional[str] = None
+    convert: Optional[Callable] = None
+
+class RecordDecoder:
+    """
+    Decoder for one entity compiled from its field list.
+
+    `decode(item)` returns a plain tuple in `columns` order, built by a
+    function generated once from the fields (one dict lookup and at most
+    one call per column, no per-field branching). `row(item, **context)`
+    returns the dict form the bulk writers take, with loader context such
+    as the BIN being loaded overriding item values.
+    """
+    def __init__(self, model, fields: Sequence[Field]):
+        self.model = model
+        self.columns: Tuple[str, ...] = tuple(f.column for f in fields)
+        namespace = {}
+        values = []
+        for i, f in enumerate(fields):
+            value = f"get({f.key or f.column!r})"
+            if f.convert:
+                namespace[f'convert_{i}'] = f.convert
+                value = f"convert_{i}({value})"
+            values.append(value)
+        source = f"def decode(item):\n    get = item.get\n    return ({', '.join(values)},)\n"
+        exec(compile(source, f'<decoder {model.__tablename__}>', 'exec'), namespace)
+        self.decode: Callable[[dict], tuple] = namespace['decode']
+
+    def row(self, item: dict, **context) -> dict:
+        row = dict(zip(self.columns, self.decode(item)))
+        if context:
+            row.update(context)
+        return row
+
+PLAN = RecordDecoder(PlanPoint, [
+    Field('id'),
+    Field('subject_biin'),
+    Field('ref_enstru_code'),
+    Field('ref_units_code'),
+    Field('price'),
+    Field('count'),
+    Field('amount'),
+    Field('date_approved', convert=parse_date),
+    Field('kato_code', key='kato', convert=first_kato),
+])
+
+ANNOUNCEMENT = RecordDecoder(Announcement, [
+    Field('id'),
+    Field('number_anno'),
+    Field('name_ru'),
+    Field('org_bin'),
+    Field('total_sum'),
+    Field('publish_date', convert=parse_date),
+    Field('start_date', convert=parse_date),
+    Field('end_date', convert=parse_date),
+    Field('ref_buy_status_id'),
+])
+
+LOT = RecordDecoder(Lot, [
+    Field('id'),
+    Field('trd_buy_id'),
+    Field('lot_number'),
+    Field('name_ru'),
+    Field('amount'),
+    Field('count'),
+    Field('customer_bin'),
+    Field('ref_lot_status_id'),
+])
+
+CONTRACT = RecordDecoder(Contract, [
+    Field('id'),
+    Field('contract_number'),
+    Field('trd_buy_id', convert=zero_to_none),
+    Field('crdate', convert=parse_date),
+    Field('contract_sum'),
+    Field('supplier_biin', convert=blank_to_none),
+    Field('customer_bin'),
+    Field('ref_contract_status_id'),
+])
+
+CONTRACT_UNIT = RecordDecoder(ContractUnit, [
+    Field('id'),
+    Field('contract_id'),
+    Field('pln_point_id'),
+    Field('item_price'),
+    Field('quantity'),
+    Field('total_sum'),
+])
+
+SUBJECT = RecordDecoder(Subject, [
+    Field('bin'),
+    Field('name_ru'),
+    Field('name_kz'),
+])
@@ -1,63 +1,89 @@
+import asyncio
+import argparse
 import logging
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from src.config import OWS_MAX_CONCURRENCY
 from src.db.session import SessionLocal
 from src.db.models import PlanPoint, RefEnstru
-from src.etl.client import GoszakupClient
+from src.etl.async_client import AsyncGoszakupClient
+from src.etl.lookup_failures import backing_off, record_failures, clear_failures
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def enrich_enstru(client: GoszakupClient, db: Session):
+FAILURE_KIND = 'enstru'
+# codes fetched concurrently and committed together
+BATCH_SIZE = 200
+
+def find_missing_enstru(db: Session):
     subquery = db.query(RefEnstru.code)
-    
-    missing_ktrus = db.query(
-        PlanPoint.ref_enstru_code, 
+
+    # one sample plan per code, codes whose last lookup failed wait for their retry time
+    return db.query(
+        PlanPoint.ref_enstru_code,
         func.max(PlanPoint.id).label('sample_plan_id')
     ).filter(
         PlanPoint.ref_enstru_code.isnot(None),
-        ~PlanPoint.ref_enstru_code.in_(subquery)
+        ~PlanPoint.ref_enstru_code.in_(subquery),
+        ~backing_off(FAILURE_KIND, PlanPoint.ref_enstru_code)
     ).group_by(
         PlanPoint.ref_enstru_code
     ).all()
 
+async def fetch_enstru_names(client: AsyncGoszakupClient, batch):
+    async def fetch(ktru_code, plan_id):
+        try:
+            return ktru_code, await client.get(f'/v3/plans/view/{plan_id}'), None
+        except Exception as e:
+            return ktru_code, None, f"plan {plan_id}: {e}"
+
+    rows, errors = [], {}
+    for ktru_code, data, error in await asyncio.gather(*(fetch(code, plan_id) for code, plan_id in batch)):
+        if error:
+            errors[ktru_code] = error
+            continue
+        name_ru = data.get('name_ru')
+        name_kz = data.get('name_kz')
+        rows.append(dict(
+            code=ktru_code,
+            name_ru=name_ru if name_ru and str(name_ru).strip() else "Неизвестное наименование",
+            name_kz=name_kz if name_kz and str(name_kz).strip() else "Белгісіз атау",
+        ))
+    return rows, errors
+
+async def enrich_enstru_async(db: Session, workers: int):
+    missing_ktrus = find_missing_enstru(db)
     total = len(missing_ktrus)
     logger.info(f"Found {total} unique KTRU codes missing descriptions. Starting enrichment.")
-    
+
     added_count = 0
-    for idx, (ktru_code, plan_id) in enumerate(missing_ktrus, 1):
-        try:
-            data = client.get(f'/v3/plans/view/{plan_id}')
-            
-            name_ru = data.get('name_ru')
-            name_kz = data.get('name_kz')
-            
-            name_ru = name_ru if name_ru and str(name_ru).strip() else "Неизвестное наименование"
-            name_kz = name_kz if name_kz and str(name_kz).strip() else "Белгісіз атау"
-            
-            new_enstru = RefEnstru(
-                code=ktru_code,
-                name_ru=name_ru,
-                name_kz=name_kz
-            )
-            db.add(new_enstru)
-            added_count += 1
-            
-        except Exception as e:
-            logger.debug(f"Failed to fetch details for KTRU {ktru_code} (Plan {plan_id}): {e}")
-            
-        # Commit periodically
-        if idx % 50 == 0:
+    failed_count = 0
+    async with AsyncGoszakupClient(max_concurrency=workers) as client:
+        for start in range(0, total, BATCH_SIZE):
+            rows, errors = await fetch_enstru_names(client, missing_ktrus[start:start + BATCH_SIZE])
+            if rows:
+                db.execute(insert(RefEnstru).values(rows).on_conflict_do_nothing(index_elements=['code']))
+                clear_failures(db, FAILURE_KIND, [row['code'] for row in rows])
+            record_failures(db, FAILURE_KIND, errors)
             db.commit()
-            logger.info(f"Processed {idx}/{total} KTRU codes.")
-            
-    db.commit()
-    logger.info(f"Enrichment Complete. Added {added_count} KTRU descriptions.")
+            added_count += len(rows)
+            failed_count += len(errors)
+            logger.info(f"Processed {min(start + BATCH_SIZE, total)}/{total} KTRU codes.")
+
+    logger.info(f"Enrichment Complete. Added {added_count} KTRU descriptions, {failed_count} lookups failed.")
+
+def enrich_enstru(db: Session, workers: int = OWS_MAX_CONCURRENCY):
+    asyncio.run(enrich_enstru_async(db, workers))
 
 if __name__ == "__main__":
-    client = GoszakupClient()
+    parser = argparse.ArgumentParser(description="Fill ref_enstru for KTRU codes used by plans")
+    parser.add_argument('--workers', type=int, default=OWS_MAX_CONCURRENCY, help="lookups in flight at once")
+    args = parser.parse_args()
+
     db_session = SessionLocal()
     try:
-        enrich_enstru(client, db_session)
+        enrich_enstru(db_session, args.workers)
     finally:
-        db_session.close()
\ No newline at end of file
+        db_session.close()
@@ -1,138 +1,137 @@
+import asyncio
+import argparse
 import logging
-from datetime import datetime
+from typing import Iterable, List, Set, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from src.config import OWS_MAX_CONCURRENCY
 from src.db.session import SessionLocal
-from src.db.models import Announcement, Lot, Subject
-from src.etl.client import GoszakupClient
+from src.db.models import Announcement, Lot
+from src.etl.async_client import AsyncGoszakupClient
+from src.etl.bulk import BulkWriter, existing_ids
+from src.etl.client import extract_items
+from src.etl.dead_letters import LOTS, FailedFetch, dead_letter_row
+from src.etl.decoders import ANNOUNCEMENT, LOT
+from src.etl.subjects import subject_registry
+from src.utils.cleaners import sanitize_lot_texts
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def parse_date(date_str: str):
-    if not date_str:
+# announcements fetched concurrently and committed together
+BATCH_SIZE = 200
+
+def announcement_rows(item: dict, lots_items) -> List[Tuple[type, dict]]:
+    trd_buy_id = item.get('id')
+    subject_registry.see(item.get('org_bin'))
+    rows = [(Announcement, ANNOUNCEMENT.row(item))]
+    if isinstance(lots_items, FailedFetch):
+        # replayed by replay_dead_letters; the lots keep their own customer_bin
+        rows.append(dead_letter_row(LOTS, trd_buy_id, lots_items))
+        return rows
+    lot_names = sanitize_lot_texts([l_item.get('name_ru') for l_item in lots_items])
+    for l_item, lot_name in zip(lots_items, lot_names):
+        subject_registry.see(l_item.get('customer_bin'))
+        rows.append((Lot, LOT.row(l_item, trd_buy_id=trd_buy_id, name_ru=lot_name)))
+    return rows
+
+async def fetch_announcement(client: AsyncGoszakupClient, trd_buy_id: int):
+    # the announcement and its lots are independent requests, both go out at once
+    lots_path = f'/v3/lots/trd-buy/{trd_buy_id}'
+    data, lots_data = await asyncio.gather(
+        client.get(f'/v3/trd-buy/{trd_buy_id}'), client.get(lots_path), return_exceptions=True,
+    )
+    if isinstance(data, Exception):
+        # nothing stored, the next backfill finds the announcement missing again
+        logger.warning(f"announcement {trd_buy_id}: fetch failed, skipped: {data}")
         return None
-    clean_str = str(date_str).replace('T', ' ').split('.')[0]
-    try:
-        return datetime.strptime(clean_str, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        try:
-            return datetime.strptime(clean_str, "%Y-%m-%d")
-        except ValueError:
-            return None
+    item = data[0] if isinstance(data, list) and len(data) > 0 else data
+    if not item or 'id' not in item:
+        return None
+    if isinstance(lots_data, Exception):
+        logger.warning(f"announcement {trd_buy_id}: lots fetch failed, dead-lettered: {lots_data}")
+        return item, FailedFetch(lots_path, str(lots_data))
+    return item, extract_items(lots_data)
 
-def upsert_subject(db: Session, bin_number: str):
-    if not bin_number:
-        return
-    subject = db.query(Subject).filter(Subject.bin == bin_number).first()
-    if not subject:
-        subject = Subject(bin=bin_number)
-        db.merge(subject)
+async def load_missing(db: Session, missing_ids: List[int], client: AsyncGoszakupClient) -> Set[int]:
+    loaded = set()
+    writer = BulkWriter(db, update=True)
+    for start in range(0, len(missing_ids), BATCH_SIZE):
+        batch = missing_ids[start:start + BATCH_SIZE]
+        fetched = await asyncio.gather(*(fetch_announcement(client, trd_buy_id) for trd_buy_id in batch))
+        for trd_buy_id, result in zip(batch, fetched):
+            if result is None:
+                continue
+            for model, row in announcement_rows(*result):
+                writer.add(model, row)
+            loaded.add(trd_buy_id)
+        writer.flush()
         db.commit()
+        if len(missing_ids) > BATCH_SIZE:
+            logger.info(f"processed {min(start + BATCH_SIZE, len(missing_ids))}/{len(missing_ids)}")
+    return loaded
 
-def ensure_announcement(client, db, trd_buy_id):
-    if not trd_buy_id:
-        return True
-    if db.query(Announcement.id).filter(Announcement.id == trd_buy_id).first():
-        return True
-    try:
-        data = client.get(f'/v3/trd-buy/{trd_buy_id}')
-        item = data[0] if isinstance(data, list) and len(data) > 0 else data
-        if not item or 'id' not in item:
-            return False
-        org_bin = item.get('org_bin')
-        upsert_subject(db, org_bin)
-        anno = Announcement(
-            id=item.get('id'),
-            number_anno=item.get('number_anno'),
-            name_ru=item.get('name_ru'),
-            org_bin=org_bin,
-            total_sum=item.get('total_sum'),
-            publish_date=parse_date(item.get('publish_date')),
-            start_date=parse_date(item.get('start_date')),
-            end_date=parse_date(item.get('end_date')),
-            ref_buy_status_id=item.get('ref_buy_status_id'),
-        )
-        db.merge(anno)
-        lots_data = client.get(f'/v3/lots/trd-buy/{trd_buy_id}')
-        lots_items = lots_data if isinstance(lots_data, list) else lots_data.get('items', [])
-        for l_item in lots_items:
-            cust_bin = l_item.get('customer_bin')
-            upsert_subject(db, cust_bin)
-            lot = Lot(
-                id=l_item.get('id'),
-                trd_buy_id=trd_buy_id,
-                lot_number=l_item.get('lot_number'),
-                name_ru=l_item.get('name_ru'), amount=l_item.get('amount'),
-                count=l_item.get('count'), customer_bin=cust_bin,
-                ref_lot_status_id=l_item.get('ref_lot_status_id')
-            )
-            db.merge(lot)
-        db.commit()
-        return True
-    except Exception as e:
-        db.rollback()
-        logger.debug(f"ensure announcement {trd_buy_id}: {e}")
-        return False
+class AnnouncementLoader:
+    """
+    Fetches missing announcements for callers that backfill many times in a
+    row, e.g. once per contract page: every call shares one event loop and one
+    client with its connection pool. Used from a single thread.
+    """
+    def __init__(self, workers: int = OWS_MAX_CONCURRENCY):
+        self.loop = asyncio.new_event_loop()
+        self.client = AsyncGoszakupClient(max_concurrency=workers)
 
-def backfill_announcements(client, db):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.loop.run_until_complete(self.client.close())
+        self.loop.close()
+
+    def load(self, db: Session, trd_buy_ids: Iterable[int]) -> Set[int]:
+        """
+        Makes sure the given announcements and their lots are stored, fetching
+        the missing ones. Returns the ids that are stored afterwards.
+        """
+        ids = {trd_buy_id for trd_buy_id in trd_buy_ids if trd_buy_id}
+        stored = existing_ids(db, Announcement, ids)
+        missing = sorted(ids - stored)
+        if missing:
+            subject_registry.warm(db)
+            stored |= self.loop.run_until_complete(load_missing(db, missing, self.client))
+        return stored
+
+def load_announcements(db: Session, trd_buy_ids: Iterable[int], workers: int = OWS_MAX_CONCURRENCY) -> Set[int]:
+    """One-off AnnouncementLoader.load."""
+    with AnnouncementLoader(workers) as loader:
+        return loader.load(db, trd_buy_ids)
+
+def backfill_announcements(db: Session, workers: int = OWS_MAX_CONCURRENCY):
     logger.info("backfilling missing announcements")
     query = text("""
-        SELECT DISTINCT trd_buy_id 
-        FROM contracts 
-        WHERE trd_buy_id IS NOT NULL 
-          AND trd_buy_id NOT IN (SELECT id FROM announcements)
+        SELECT DISTINCT c.trd_buy_id
+        FROM contracts c
+        WHERE c.trd_buy_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM announcements a WHERE a.id = c.trd_buy_id)
     """)
     missing_ids = [row[0] for row in db.execute(query).fetchall()]
     if not missing_ids:
         logger.info("no missing announcements")
         return
     logger.info(f"found {len(missing_ids)} missing, fetching")
-    added_count = 0
-    for idx, trd_buy_id in enumerate(missing_ids, 1):
-        try:
-            data = client.get(f'/v3/trd-buy/{trd_buy_id}')
-            item = data[0] if isinstance(data, list) and len(data) > 0 else data
-            if not item or 'id' not in item:
-                continue
-            org_bin = item.get('org_bin')
-            upsert_subject(db, org_bin)
-            anno = Announcement(
-                id=item.get('id'), number_anno=item.get('number_anno'), name_ru=item.get('name_ru'),
-                org_bin=org_bin, total_sum=item.get('total_sum'),
-                publish_date=parse_date(item.get('publish_date')), start_date=parse_date(item.get('start_date')),
-                end_date=parse_date(item.get('end_date')), ref_buy_status_id=item.get('ref_buy_status_id')
-            )
-            db.merge(anno)
-            lots_data = client.get(f'/v3/lots/trd-buy/{trd_buy_id}')
-            lots_items = lots_data if isinstance(lots_data, list) else lots_data.get('items', [])
-            for l_item in lots_items:
-                cust_bin = l_item.get('customer_bin')
-                upsert_subject(db, cust_bin)
-                lot = Lot(
-                    id=l_item.get('id'),
-                    trd_buy_id=trd_buy_id, 
-                    lot_number=l_item.get('lot_number'),
-                    name_ru=l_item.get('name_ru'), 
-                    amount=l_item.get('amount'), 
-                    count=l_item.get('count'),
-                    customer_bin=cust_bin, 
-                    ref_lot_status_id=l_item.get('ref_lot_status_id')
-                )
-                db.merge(lot)
-            db.commit()
-            added_count += 1
-            if idx % 50 == 0:
-                logger.info(f"processed {idx}/{len(missing_ids)}")
-        except Exception as e:
-            db.rollback()
-            logger.debug(f"backfill {trd_buy_id}: {e}")
-    logger.info(f"backfill done, added {added_count}")
+    stored = load_announcements(db, missing_ids, workers)
+    logger.info(f"backfill done, added {len(stored)}")
 
 if __name__ == "__main__":
-    client = GoszakupClient()
+    parser = argparse.ArgumentParser(description="Fetch announcements referenced by contracts but not stored")
+    parser.add_argument('--workers', type=int, default=OWS_MAX_CONCURRENCY, help="requests in flight at once")
+    args = parser.parse_args()
+
     db_session = SessionLocal()
     try:
-        backfill_announcements(client, db_session)
+        backfill_announcements(db_session, args.workers)
     finally:
         db_session.close()
@@ -1,48 +1,89 @@
+import time
+import asyncio
+import argparse
 import logging
+from sqlalchemy import update
 from sqlalchemy.orm import Session
+from src.config import OWS_MAX_CONCURRENCY
 from src.db.session import SessionLocal
 from src.db.models import Subject
-from src.etl.client import GoszakupClient
+from src.etl.async_client import AsyncGoszakupClient
+from src.etl.decoders import SUBJECT
+from src.etl.lookup_failures import backing_off, record_failures, clear_failures
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def enrich_subjects(client: GoszakupClient, db: Session):
-    subjects_to_update = db.query(Subject).filter(Subject.name_ru.is_(None)).all()
-    total = len(subjects_to_update)
-    
-    logger.info(f"Found {total} subjects missing names. Starting enrichment.")
-    
-    updated_count = 0
-    for idx, subject in enumerate(subjects_to_update, 1):
-        if not subject.bin:
-            continue
-            
+FAILURE_KIND = 'subject'
+# BINs read per keyset page, fetched concurrently and updated in one executemany
+BATCH_SIZE = 500
+
+def subjects_missing_names(db: Session, after_pid: int, limit: int):
+    return db.query(Subject.pid, Subject.bin).filter(
+        Subject.name_ru.is_(None),
+        Subject.bin.isnot(None),
+        Subject.pid > after_pid,
+        ~backing_off(FAILURE_KIND, Subject.bin)
+    ).order_by(Subject.pid).limit(limit).all()
+
+async def fetch_subject_names(client: AsyncGoszakupClient, batch):
+    async def fetch(pid, bin_number):
         try:
-            endpoint = f'/v3/subject/biin/{subject.bin}'
-            data = client.get(endpoint)
-            
-            item = data[0] if isinstance(data, list) and len(data) > 0 else data
-            
-            if isinstance(item, dict):
-                subject.name_ru = item.get('name_ru')
-                subject.name_kz = item.get('name_kz')
-                updated_count += 1
-                
+            return pid, bin_number, await client.get(f'/v3/subject/biin/{bin_number}'), None
         except Exception as e:
-            logger.debug(f"Failed to fetch profile for BIN {subject.bin}: {e}")
-            
-        if idx % 50 == 0:
+            return pid, bin_number, None, str(e)
+
+    updates, errors = [], {}
+    for pid, bin_number, data, error in await asyncio.gather(*(fetch(pid, b) for pid, b in batch)):
+        item = data[0] if isinstance(data, list) and len(data) > 0 else data
+        subject = SUBJECT.row(item) if isinstance(item, dict) else {}
+        if subject.get('name_ru'):
+            updates.append(dict(pid=pid, name_ru=subject['name_ru'], name_kz=subject['name_kz']))
+        else:
+            errors[bin_number] = error or "profile without name_ru"
+    return updates, errors
+
+async def enrich_subjects_async(db: Session, workers: int):
+    logger.info("Streaming subjects missing names. Starting enrichment.")
+
+    started = time.monotonic()
+    last_pid = 0
+    processed = 0
+    updated_count = 0
+    async with AsyncGoszakupClient(max_concurrency=workers) as client:
+        while True:
+            # keyset pagination, only one page of BINs is held in memory
+            batch = subjects_missing_names(db, last_pid, BATCH_SIZE)
+            if not batch:
+                break
+            last_pid = batch[-1].pid
+
+            updates, errors = await fetch_subject_names(client, batch)
+            if updates:
+                # bulk UPDATE by primary key, executed as one executemany
+                db.execute(update(Subject), updates)
+                pid_to_bin = dict(batch)
+                clear_failures(db, FAILURE_KIND, [pid_to_bin[u['pid']] for u in updates])
+            record_failures(db, FAILURE_KIND, errors)
             db.commit()
-            logger.info(f"Processed {idx}/{total} subjects.")
-            
-    db.commit()
+
+            processed += len(batch)
+            updated_count += len(updates)
+            elapsed = time.monotonic() - started
+            logger.info(f"Processed {processed} subjects ({updated_count} named), {processed / elapsed:.1f} subjects/s.")
+
     logger.info(f"Enrichment Complete. Updated {updated_count} supplier/customer names.")
 
+def enrich_subjects(db: Session, workers: int = OWS_MAX_CONCURRENCY):
+    asyncio.run(enrich_subjects_async(db, workers))
+
 if __name__ == "__main__":
-    client = GoszakupClient()
+    parser = argparse.ArgumentParser(description="Fill subject names from OWS profiles")
+    parser.add_argument('--workers', type=int, default=OWS_MAX_CONCURRENCY, help="lookups in flight at once")
+    args = parser.parse_args()
+
     db_session = SessionLocal()
     try:
-        enrich_subjects(client, db_session)
+        enrich_subjects(db_session, args.workers)
     finally:
-        db_session.close()
\ No newline at end of file
+        db_session.close()
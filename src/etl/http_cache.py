@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional
+from src.config import OWS_CACHE_DIR, OWS_CACHE_MODE, OWS_CACHE_MAX_MB
+from src.etl.decoders import json_loads
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+# per-endpoint TTLs; endpoints not listed (paginated lists) are only kept in record/replay
+CACHE_TTLS = [
+    (re.compile(r'^/v3/plans/view/\d+$'), 30 * DAY),
+    (re.compile(r'^/v3/subject/biin/\d+$'), 7 * DAY),
+    (re.compile(r'^/v3/contract/\d+/units$'), 7 * DAY),
+    (re.compile(r'^/v3/trd-buy/\d+$'), DAY),
+    (re.compile(r'^/v3/lots/trd-buy/\d+$'), DAY),
+    (re.compile(r'^/v3/refs/'), DAY),
+]
+
+MODES = ('off', 'on', 'record', 'replay')
+
+class CacheMiss(RuntimeError):
+    pass
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of OWS JSON responses.
+
+    Modes:
+      on     - serve fresh entries per CACHE_TTLS, store cacheable responses
+      record - always hit the API, store every response (lists included)
+      replay - never hit the API, serve every stored response regardless of age
+    """
+    def __init__(self, root: str, mode: str = 'on', max_bytes: int = 2048 * 1024 * 1024):
+        if mode not in MODES:
+            raise ValueError(f"unknown cache mode {mode!r}, expected one of {MODES}")
+        self.root = root
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = None
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def ttl_for(path: str) -> int:
+        for pattern, ttl in CACHE_TTLS:
+            if pattern.match(path):
+                return ttl
+        return 0
+
+    def _file(self, path: str, params: Optional[dict]) -> str:
+        canonical = json.dumps([path, sorted((params or {}).items())], default=str)
+        digest = hashlib.sha256(canonical.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], f'{digest}.json')
+
+    def get(self, path: str, params: dict = None):
+        """Returns the cached payload, None when the API has to be called."""
+        if self.mode == 'record':
+            return None
+        file = self._file(path, params)
+        try:
+            stored_at = os.path.getmtime(file)
+            if self.mode == 'on' and time.time() - stored_at > self.ttl_for(path):
+                return None
+            with open(file, 'rb') as f:
+                data = json_loads(f.read())
+        except FileNotFoundError:
+            if self.mode == 'replay':
+                raise CacheMiss(f"{path} {params} is not in the replay cache {self.root}")
+            return None
+        # last access drives eviction
+        os.utime(file, (time.time(), stored_at))
+        return data
+
+    def put(self, path: str, params: dict, body: bytes):
+        if self.mode == 'replay' or (self.mode == 'on' and not self.ttl_for(path)):
+            return
+        file = self._file(path, params)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f'{file}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        with self.lock:
+            # an overwritten entry gives its size back, under the lock so concurrent puts agree
+            try:
+                replaced = os.path.getsize(file)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, file)
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(body) - replaced
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.json'):
+                    yield os.path.join(dirpath, name)
+
+    def _scan_size(self) -> int:
+        return sum(os.path.getsize(f) for f in self._entries())
+
+    def _evict(self):
+        # least recently used first, down to 90% of the cap
+        entries = sorted(self._entries(), key=os.path.getatime)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for file in entries:
+            if self.size <= target:
+                break
+            try:
+                self.size -= os.path.getsize(file)
+                os.remove(file)
+                removed += 1
+            except FileNotFoundError:
+                continue
+        logger.info(f"response cache evicted {removed} entries, {self.size // (1024 * 1024)} MB left")
+
+def cache_from_config() -> Optional[ResponseCache]:
+    if OWS_CACHE_MODE == 'off':
+        return None
+    logger.info(f"OWS response cache in {OWS_CACHE_MODE!r} mode at {OWS_CACHE_DIR}")
+    return ResponseCache(OWS_CACHE_DIR, OWS_CACHE_MODE, OWS_CACHE_MAX_MB * 1024 * 1024)
+
+# shared by every client in the process, so the size cap is accounted once
+response_cache = cache_from_config()
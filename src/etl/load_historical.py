@@ -1,9 +1,23 @@
+import argparse
 import logging
 from datetime import datetime
+from functools import partial
+from typing import Callable, Iterator, Optional
 from sqlalchemy.orm import Session
+from src.config import ETL_WORKERS
 from src.db.session import SessionLocal
-from src.db.models import Subject, PlanPoint, Announcement, Lot, Contract, ContractUnit, RefUnit
-from src.etl.client import GoszakupClient
+from src.db.models import PlanPoint, Announcement, Lot, Contract, ContractUnit, RefUnit
+from src.etl.bulk import BulkWriter, CopyWriter
+from src.etl.checkpoints import Checkpoint
+from src.etl.dead_letters import LOTS, CONTRACT_UNITS, FailedFetch, dead_letter_row
+from src.etl.client import GoszakupClient, Page, extract_items
+from src.etl.decoders import PLAN, ANNOUNCEMENT, LOT, CONTRACT, CONTRACT_UNIT, blank_to_none, parse_date
+from src.etl.refs_sync import sync_references
+from src.etl.pipeline import COMMIT_EVERY, run_pipeline, filter_pages, skip_existing
+from src.etl.price_stats import refresh_price_stats
+from src.etl.subjects import subject_registry
+from src.etl.workers import run_for_bins
+from src.utils.cleaners import sanitize_lot_texts
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -19,165 +33,155 @@ TARGET_BINS = [
 ]
 
 CUTOFF_DATE = datetime(2024, 1, 1)
+# rows per transaction in --backfill mode, COPY pays off on large merges
+BACKFILL_COMMIT_EVERY = 50000
 
 def load_reference_dictionaries(client: GoszakupClient, db: Session):
     logger.info("Loading Reference Dictionaries (Units)")
     try:
-        seen_codes = {row[0] for row in db.query(RefUnit.code).all()}
-        for item in client.paginate('/v3/refs/ref_units'):
-            code = item.get('code')
-            if code and code not in seen_codes:
-                unit = RefUnit(
-                    code=code, 
-                    name_ru=item.get('name_ru'), 
-                    name_kz=item.get('name_kz')
-                    )
-                db.add(unit)
-                seen_codes.add(code)
-        db.commit()
-        logger.info("reference units loaded")
-    except Exception as e:
-        db.rollback()
-        logger.error(f"reference units failed: {e}")
-
-def upsert_subject(db, bin_number, name_ru=None, is_customer=False, is_supplier=False):
-    if not bin_number:
-        return None
-    subject = db.query(Subject).filter(Subject.bin == bin_number).first()
-    if not subject:
-        subject = Subject(bin=bin_number, name_ru=name_ru, is_customer=is_customer, is_supplier=is_supplier)
-        db.add(subject)
-        db.commit()
-    return subject
-
-def parse_date(date_str):
-    if not date_str:
-        return None
+        sync_references(client, db, ['ref_units'])
+    except RuntimeError:
+        # already logged, the units are picked up by the next refs run
+        pass
+
+def fetch_children(client: GoszakupClient, path: str):
+    # sub-resources of one record (lots, units), FailedFetch when the fetch failed
     try:
-        return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        try:
-            dt = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-            return dt.replace(tzinfo=None) if dt.tzinfo else dt
-        except (ValueError, TypeError):
-            return None
+        return extract_items(client.get(path))
+    except Exception as e:
+        logger.warning(f"{path}: {e}, dead-lettered")
+        return FailedFetch(path, str(e))
+
+def run_checkpointed(db: Session, writer: BulkWriter, bin_number: str, stream: str,
+                     fetch: Callable[[Optional[str]], Iterator[Page]], decode, resume: bool,
+                     commit_every: int = COMMIT_EVERY):
+    checkpoint = Checkpoint(db, bin_number, stream)
+    if resume and checkpoint.completed:
+        logger.info(f"{stream} for {bin_number} already loaded, skipping")
+        return
+    run_pipeline(fetch(checkpoint.start(resume)), decode, writer, db,
+                 commit_every=commit_every, on_commit=checkpoint.save)
+    checkpoint.finish()
+    db.commit()
 
-def load_data_for_bin(client: GoszakupClient, db: Session, bin_number: str):
+def load_data_for_bin(client: GoszakupClient, db: Session, bin_number: str,
+                      resume: bool = False, backfill: bool = False):
     logger.info(f"processing bin {bin_number}")
-    upsert_subject(db, bin_number, is_customer=True)
+    subject_registry.warm(db)
+    subject_registry.see(bin_number, is_customer=True)
+    writer = CopyWriter(db) if backfill else BulkWriter(db)
+    commit_every = BACKFILL_COMMIT_EVERY if backfill else COMMIT_EVERY
 
     logger.info("plans")
-    for item in client.paginate(f'/v3/plans/{bin_number}'):
-        date_appr = parse_date(item.get('date_approved'))
-        if date_appr and date_appr < CUTOFF_DATE:
-            continue
-        if not db.query(PlanPoint).filter(PlanPoint.id == item['id']).first():
-            kato_list = item.get('kato', [])
-            kato_code = kato_list[0].get('ref_kato_code') if kato_list else None
-            unit_code = item.get('ref_units_code')
-            if unit_code and not db.query(RefUnit).filter(RefUnit.code == unit_code).first():
-                db.add(RefUnit(code=unit_code, name_ru="Неизвестный код", name_kz="Белгісіз код"))
-                db.commit()
-            plan = PlanPoint(
-                id=item['id'], 
-                subject_biin=bin_number, 
-                ref_enstru_code=item.get('ref_enstru_code'),
-                ref_units_code=unit_code, 
-                price=item.get('price'), 
-                count=item.get('count'),
-                amount=item.get('amount'), 
-                date_approved=date_appr, 
-                kato_code=kato_code
-            )
-            db.add(plan)
-    db.commit()
+    known_units = {row[0] for row in db.query(RefUnit.code).all()}
+
+    def decode_plans(items):
+        rows = []
+        for item in items:
+            plan = PLAN.row(item, subject_biin=bin_number)
+            if plan['date_approved'] and plan['date_approved'] < CUTOFF_DATE:
+                continue
+            unit_code = plan['ref_units_code']
+            if unit_code and unit_code not in known_units:
+                rows.append((RefUnit, dict(code=unit_code, name_ru="Неизвестный код", name_kz="Белгісіз код")))
+                known_units.add(unit_code)
+            rows.append((PlanPoint, plan))
+        return rows
+
+    run_checkpointed(
+        db, writer, bin_number, 'plans',
+        lambda token: client.iter_pages(f'/v3/plans/{bin_number}', next_page=token),
+        decode_plans, resume, commit_every,
+    )
 
-    logger.info("announcements and lots")
-    for item in client.paginate('/v3/trd-buy', params={'customer_bin': bin_number}):
+    # the fetch stage runs in its own thread, existence lookups there get their own session
+    fetch_db = SessionLocal()
+
+    def with_lots(item):
         pub_date = parse_date(item.get('publish_date'))
         if pub_date and pub_date < CUTOFF_DATE:
-            continue
-        anno_id = item.get('id')
-        if not db.query(Announcement).filter(Announcement.id == anno_id).first():
-            anno = Announcement(
-                id=anno_id, 
-                number_anno=item.get('number_anno'), 
-                name_ru=item.get('name_ru'),
-                org_bin=bin_number, 
-                total_sum=item.get('total_sum'), 
-                publish_date=pub_date,
-                start_date=parse_date(item.get('start_date')), 
-                end_date=parse_date(item.get('end_date')),
-                ref_buy_status_id=item.get('ref_buy_status_id')
-            )
-            db.add(anno)
-            try:
-                lots_data = client.get(f'/v3/lots/trd-buy/{anno_id}')
-                lots_items = lots_data if isinstance(lots_data, list) else lots_data.get('items', [])
-                for l_item in lots_items:
-                    if not db.query(Lot).filter(Lot.id == l_item.get('id')).first():
-                        lot = Lot(
-                            id=l_item.get('id'), 
-                            trd_buy_id=anno_id, 
-                            lot_number=l_item.get('lot_number'),
-                            name_ru=l_item.get('name_ru'), 
-                            amount=l_item.get('amount'),
-                            count=l_item.get('count'), 
-                            customer_bin=bin_number,
-                            ref_lot_status_id=l_item.get('ref_lot_status_id')
-                        )
-                        db.add(lot)
-            except Exception as e:
-                logger.warning(f"lots for anno {anno_id}: {e}")
-    db.commit()
+            return None
+        return item, fetch_children(client, f"/v3/lots/trd-buy/{item.get('id')}")
 
-    logger.info("contracts and units")
-    valid_plan_ids = {row[0] for row in db.query(PlanPoint.id).all()}
-    valid_anno_ids = {row[0] for row in db.query(Announcement.id).all()}
-    for item in client.paginate(f'/v3/contract/customer/{bin_number}'):
+    def decode_announcements(items):
+        rows = []
+        # lot names of the whole page sanitized in one batch
+        lot_names = iter(sanitize_lot_texts([
+            l_item.get('name_ru') for _, lots_items in items if not isinstance(lots_items, FailedFetch) for l_item in lots_items
+        ]))
+        for item, lots_items in items:
+            anno_id = item.get('id')
+            rows.append((Announcement, ANNOUNCEMENT.row(item, org_bin=bin_number)))
+            if isinstance(lots_items, FailedFetch):
+                rows.append(dead_letter_row(LOTS, anno_id, lots_items, bin_number))
+                continue
+            for l_item in lots_items:
+                rows.append((Lot, LOT.row(l_item, trd_buy_id=anno_id, customer_bin=bin_number, name_ru=next(lot_names))))
+        return rows
+
+    def with_units(item):
         crdate = parse_date(item.get('crdate'))
         if crdate and crdate < CUTOFF_DATE:
-            continue
-        contract_id = item.get('id')
-        raw_supplier_bin = item.get('supplier_biin')
-        supplier_bin = raw_supplier_bin if raw_supplier_bin and str(raw_supplier_bin).strip() else None
+            return None
+        supplier_bin = blank_to_none(item.get('supplier_biin'))
         if supplier_bin:
-            upsert_subject(db, supplier_bin, is_supplier=True)
-        if not db.query(Contract).filter(Contract.id == contract_id).first():
-            raw_trd_id = item.get('trd_buy_id')
-            safe_trd_id = raw_trd_id if raw_trd_id in valid_anno_ids else None
-            contract = Contract(
-                id=contract_id, contract_number=item.get('contract_number'), trd_buy_id=safe_trd_id,
-                crdate=crdate, contract_sum=item.get('contract_sum'), supplier_biin=supplier_bin,
-                customer_bin=bin_number, ref_contract_status_id=item.get('ref_contract_status_id')
-            )
-            db.add(contract)
-            
-            try:
-                units_data = client.get(f'/v3/contract/{contract_id}/units')
-                units_items = units_data if isinstance(units_data, list) else units_data.get('items', [])
-                for u_item in units_items:
-                    unit_id = u_item.get('id')
-                    raw_pln_id = u_item.get('pln_point_id')
-                    safe_pln_id = raw_pln_id if raw_pln_id in valid_plan_ids else None
-                    if not db.query(ContractUnit).filter(ContractUnit.id == unit_id).first():
-                        unit = ContractUnit(
-                            id=unit_id, contract_id=contract_id, pln_point_id=safe_pln_id,
-                            item_price=u_item.get('item_price'), quantity=u_item.get('quantity'),
-                            total_sum=u_item.get('total_sum')
-                        )
-                        db.add(unit)
-            except Exception:
-                pass
-    db.commit()
+            subject_registry.see(supplier_bin, is_supplier=True)
+        return item, fetch_children(client, f"/v3/contract/{item.get('id')}/units")
+
+    def decode_contracts(items):
+        rows = []
+        for item, units_items in items:
+            contract_id = item.get('id')
+            rows.append((Contract, CONTRACT.row(item, customer_bin=bin_number)))
+            if isinstance(units_items, FailedFetch):
+                rows.append(dead_letter_row(CONTRACT_UNITS, contract_id, units_items, bin_number))
+                continue
+            for u_item in units_items:
+                rows.append((ContractUnit, CONTRACT_UNIT.row(u_item, contract_id=contract_id)))
+        return rows
+
+    try:
+        logger.info("announcements and lots")
+        run_checkpointed(
+            db, writer, bin_number, 'announcements',
+            lambda token: filter_pages(skip_existing(
+                client.iter_pages('/v3/trd-buy', params={'customer_bin': bin_number}, next_page=token),
+                fetch_db, Announcement,
+            ), with_lots),
+            decode_announcements, resume, commit_every,
+        )
+        logger.info("contracts and units")
+        run_checkpointed(
+            db, writer, bin_number, 'contracts',
+            lambda token: filter_pages(skip_existing(
+                client.iter_pages(f'/v3/contract/customer/{bin_number}', next_page=token),
+                fetch_db, Contract,
+            ), with_units),
+            decode_contracts, resume, commit_every,
+        )
+    finally:
+        fetch_db.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Historical load for TARGET_BINS")
+    parser.add_argument('--workers', type=int, default=ETL_WORKERS, help="BINs loaded in parallel")
+    parser.add_argument('--resume', action='store_true', help="continue every BIN from its last committed page")
+    parser.add_argument('--backfill', action='store_true',
+                        help="write through COPY into staging tables, for seeding an empty database")
+    args = parser.parse_args()
+
     client = GoszakupClient()
     db_session = SessionLocal()
     try:
         load_reference_dictionaries(client, db_session)
-        for bin_code in TARGET_BINS:
-            load_data_for_bin(client, db_session, bin_code)
-        logger.info("historical load done")
     finally:
         db_session.close()
+    results = run_for_bins(partial(load_data_for_bin, resume=args.resume, backfill=args.backfill), TARGET_BINS, workers=args.workers)
+    db_session = SessionLocal()
+    try:
+        refresh_price_stats(db_session)
+    finally:
+        db_session.close()
+    logger.info("historical load done")
+    if not all(r.ok for r in results):
+        raise SystemExit(1)
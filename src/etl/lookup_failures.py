@@ -0,0 +1,47 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable
+from sqlalchemy import Integer, exists, func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.db.models import LookupFailure
+
+logger = logging.getLogger(__name__)
+
+# first retry after a day, then doubling per failed attempt up to a month
+RETRY_FIRST = timedelta(days=1)
+RETRY_MAX_DAYS = 30
+
+def backing_off(kind: str, key_column):
+    """Filter clause, true while the last lookup of `key_column` failed and is not due yet."""
+    return exists().where(
+        LookupFailure.kind == kind,
+        LookupFailure.key == key_column,
+        LookupFailure.retry_after > datetime.now(),
+    )
+
+def record_failures(db: Session, kind: str, errors: Dict[str, str]):
+    if not errors:
+        return
+    now = datetime.now()
+    rows = [
+        dict(kind=kind, key=str(key), attempts=1, last_error=str(error)[:500], retry_after=now + RETRY_FIRST, updated_at=now)
+        for key, error in errors.items()
+    ]
+    stmt = insert(LookupFailure).values(rows)
+    backoff_days = func.least(RETRY_MAX_DAYS, func.power(2, LookupFailure.attempts)).cast(Integer)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=['kind', 'key'],
+        set_=dict(
+            attempts=LookupFailure.attempts + 1,
+            last_error=stmt.excluded.last_error,
+            retry_after=stmt.excluded.updated_at + func.make_interval(0, 0, 0, backoff_days),
+            updated_at=stmt.excluded.updated_at,
+        ),
+    ))
+    logger.info(f"{len(rows)} {kind} lookups failed, retried later")
+
+def clear_failures(db: Session, kind: str, keys: Iterable[str]):
+    keys = [str(key) for key in keys]
+    if keys:
+        db.query(LookupFailure).filter(LookupFailure.kind == kind, LookupFailure.key.in_(keys)).delete(synchronize_session=False)
@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# seconds, shared by request and flush latencies
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def endpoint(path: str) -> str:
+    # '/v3/contract/123/units' -> '/v3/contract/{id}/units', keeps label cardinality bounded
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+class Metrics:
+    """
+    Process-wide counters and latency histograms, safe to update from the
+    BIN worker threads and pipeline stages. Exported as Prometheus text or
+    as a JSON run report.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.started = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def prometheus(self) -> str:
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda kv: kv[0])
+            lines = []
+            for name in sorted({name for (name, _), _ in counters}):
+                lines.append(f'# TYPE {name} counter')
+                lines += [f'{name}{_labels(labels)} {value:g}' for (n, labels), value in counters if n == name]
+            for name in sorted({name for (name, _), _ in histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (n, labels), histogram in histograms:
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels + (("le", f"{bound:g}"),))} {cumulative}')
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def report(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            counters = [
+                dict(name=name, labels=dict(labels), value=value, per_second=value / elapsed if elapsed else 0)
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms = [
+                dict(name=name, labels=dict(labels), count=h.count, sum=h.sum,
+                     mean=h.sum / h.count if h.count else 0, p50=h.quantile(0.5), p95=h.quantile(0.95))
+                for (name, labels), h in sorted(self.histograms.items(), key=lambda kv: kv[0])
+            ]
+        return dict(seconds=elapsed, counters=counters, histograms=histograms)
+
+    def total(self, name: str) -> float:
+        with self.lock:
+            return sum(value for (n, _), value in self.counters.items() if n == name)
+
+    def write_report(self, directory: str, job: str):
+        """
+        Writes `{job}-{timestamp}.json` and `{job}.prom`, the latter in the
+        format of the node_exporter textfile collector.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        report = dict(job=job, finished_at=datetime.now().isoformat(timespec='seconds'), **self.report())
+        _write_atomic(os.path.join(directory, f'{job}-{stamp}.json'), json.dumps(report, indent=2, default=str))
+        _write_atomic(os.path.join(directory, f'{job}.prom'), self.prometheus())
+        logger.info(
+            f"{job}: {self.total('ows_requests_total'):.0f} requests, {self.total('ows_throttled_total'):.0f} throttled, "
+            f"{self.total('etl_rows_written_total'):.0f} rows written in {report['seconds']:.0f}s, report in {directory}"
+        )
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+def _write_atomic(path: str, content: str):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+metrics = Metrics()
@@ -0,0 +1,152 @@
+import time
+import queue
+import threading
+import logging
+from collections import Counter
+from dataclasses import replace
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from src.etl.bulk import BulkWriter, existing_ids
+from src.etl.client import Page
+from src.etl.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 4
+COMMIT_EVERY = 5000
+
+Row = Tuple[type, dict]
+
+_DONE = object()
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    # blocks while the next stage is behind (backpressure), gives up once the pipeline is stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def run_pipeline(
+    pages: Iterable[Page],
+    decode: Callable[[list], List[Row]],
+    writer: BulkWriter,
+    db: Session,
+    commit_every: int = COMMIT_EVERY,
+    queue_size: int = QUEUE_SIZE,
+    on_commit: Optional[Callable[[Page], None]] = None,
+) -> int:
+    """
+    Streams pages through three stages connected by bounded queues:
+
+        fetch (thread) -> decode (thread) -> write (calling thread)
+
+    `pages` is iterated in the fetch thread, so every API call it makes,
+    including sub-resource fetches, overlaps with decoding and writing.
+    `decode` turns a page's items into (model, row) pairs. The writer commits
+    every `commit_every` rows; `on_commit` runs inside each committing
+    transaction with the last page it covers. Returns the number of rows written.
+    """
+    stop = threading.Event()
+    fetched: queue.Queue = queue.Queue(maxsize=queue_size)
+    decoded: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    def fetch():
+        try:
+            for page in pages:
+                if not _put(fetched, page, stop):
+                    return
+        except BaseException as e:
+            _put(fetched, _Failed(e), stop)
+            return
+        _put(fetched, _DONE, stop)
+
+    def decode_pages():
+        while not stop.is_set():
+            try:
+                page = fetched.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if page is _DONE or isinstance(page, _Failed):
+                _put(decoded, page, stop)
+                return
+            started = time.perf_counter()
+            try:
+                rows = decode(page.items)
+            except BaseException as e:
+                _put(decoded, _Failed(e), stop)
+                return
+            metrics.observe('etl_decode_seconds', time.perf_counter() - started)
+            for model, count in Counter(model for model, _ in rows).items():
+                metrics.inc('etl_rows_decoded_total', count, table=model.__tablename__)
+            if not _put(decoded, (rows, page), stop):
+                return
+
+    stages = [
+        threading.Thread(name='etl-fetch', target=fetch, daemon=True),
+        threading.Thread(name='etl-decode', target=decode_pages, daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+
+    total = 0
+    uncommitted = 0
+    last_page = None
+    try:
+        while True:
+            msg = decoded.get()
+            if msg is _DONE:
+                break
+            if isinstance(msg, _Failed):
+                raise msg.error
+            rows, page = msg
+            for model, row in rows:
+                writer.add(model, row)
+            total += len(rows)
+            uncommitted += len(rows)
+            last_page = page
+            if uncommitted >= commit_every:
+                _commit(writer, db, on_commit, last_page)
+                uncommitted = 0
+        _commit(writer, db, on_commit, last_page)
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+    return total
+
+def _commit(writer: BulkWriter, db: Session, on_commit, page: Optional[Page]):
+    writer.flush()
+    if on_commit and page is not None:
+        on_commit(page)
+    db.commit()
+
+def filter_pages(pages: Iterable[Page], keep: Callable[[dict], object]) -> Iterator[Page]:
+    """
+    Applies `keep` to every item in the fetch stage. `keep` returns the value
+    to pass on (e.g. the item with its sub-resources), or None to drop it.
+    """
+    for page in pages:
+        items = []
+        for item in page.items:
+            kept = keep(item)
+            if kept is not None:
+                items.append(kept)
+        yield replace(page, items=items)
+
+def skip_existing(pages: Iterable[Page], db: Session, model) -> Iterator[Page]:
+    """
+    Drops items already stored in `model`'s table, one lookup per page, so
+    sub-resources are not fetched again. `db` must not be used by another stage.
+    """
+    for page in pages:
+        stored = existing_ids(db, model, (item.get('id') for item in page.items))
+        # no transaction left idle while the page travels through the pipeline
+        db.rollback()
+        yield replace(page, items=[item for item in page.items if item.get('id') not in stored])
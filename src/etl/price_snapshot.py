@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from src.config import PRICE_SNAPSHOT_DIR
+from src.db.session import SessionLocal
+from src.db.models import Contract, ContractUnit, PlanPoint
+from src.analytics.snapshot import COLUMNS, OFFSETS, DICTIONARIES, CURRENT
+from src.etl.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+FETCH_SIZE = 50000
+# snapshots kept besides the current one, a worker may still be mapping the previous
+KEEP_PREVIOUS = 1
+VERSION_PREFIX = 'snapshot-'
+
+def fetch_units(db: Session) -> pd.DataFrame:
+    # streamed with a server-side cursor, sorted by code and then unit id like the engines' examples
+    result = db.execute(
+        select(
+            PlanPoint.ref_enstru_code, PlanPoint.kato_code, Contract.customer_bin, Contract.crdate,
+            ContractUnit.item_price, ContractUnit.quantity, ContractUnit.contract_id,
+        )
+        .join(PlanPoint, ContractUnit.pln_point_id == PlanPoint.id)
+        .outerjoin(Contract, ContractUnit.contract_id == Contract.id)
+        .where(PlanPoint.ref_enstru_code.isnot(None))
+        .order_by(PlanPoint.ref_enstru_code, ContractUnit.id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+    names = ['enstru_code', 'kato_code', 'customer_bin', 'crdate', 'price', 'quantity', 'contract_id']
+    chunks = []
+    for rows in result.partitions():
+        chunk = pd.DataFrame(rows, columns=names)
+        for column in ('price', 'quantity', 'contract_id'):
+            chunk[column] = pd.to_numeric(chunk[column])
+        chunks.append(chunk)
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=names)
+
+def write_snapshot(df: pd.DataFrame, path: str, built_at: datetime):
+    # factorize numbers the values in order of appearance (the codes come sorted), NULL becomes -1
+    enstru, codes = pd.factorize(df['enstru_code'])
+    kato, katos = pd.factorize(df['kato_code'])
+    customer, customers = pd.factorize(df['customer_bin'])
+    columns = {
+        'enstru': enstru,
+        'kato': kato,
+        'customer': customer,
+        'crdate': pd.to_datetime(df['crdate']).to_numpy(),
+        'price': df['price'].to_numpy(),
+        'quantity': df['quantity'].to_numpy(),
+        'contract_id': df['contract_id'].fillna(-1).to_numpy(),
+    }
+    os.makedirs(path)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(path, f'{name}.npy'), np.asarray(columns[name]).astype(dtype))
+    np.save(os.path.join(path, OFFSETS), np.concatenate([[0], np.cumsum(np.bincount(enstru, minlength=len(codes)))]).astype(np.int64))
+    with open(os.path.join(path, DICTIONARIES), 'w', encoding='utf-8') as f:
+        json.dump(dict(
+            built_at=built_at.isoformat(timespec='seconds'),
+            enstru=list(codes), kato=list(katos), customer=list(customers),
+        ), f, ensure_ascii=False)
+
+def swap_current(root: str, version: str):
+    # rename(2) over the old link is atomic, readers see either snapshot completely
+    link = os.path.join(root, f'.{CURRENT}-{version}')
+    os.symlink(version, link)
+    os.replace(link, os.path.join(root, CURRENT))
+
+def prune(root: str, current: str):
+    versions = sorted(name for name in os.listdir(root) if name.startswith(VERSION_PREFIX) and name != current)
+    for name in versions[:max(len(versions) - KEEP_PREVIOUS, 0)]:
+        # processes still mapping it keep their pages until they remap
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def build_price_snapshot(db: Session, root: str = PRICE_SNAPSHOT_DIR):
+    """Writes the contract unit prices as memory-mappable columns and makes them current."""
+    if not root:
+        logger.info("PRICE_SNAPSHOT_DIR is not set, no price snapshot built")
+        return
+    started = time.monotonic()
+    # before the read: units written while it runs make the snapshot look older, never newer
+    built_at = datetime.now()
+    df = fetch_units(db)
+    db.rollback()
+
+    os.makedirs(root, exist_ok=True)
+    version = f"{VERSION_PREFIX}{datetime.now().strftime('%Y%m%dT%H%M%S%f')}"
+    write_snapshot(df, os.path.join(root, version), built_at)
+    swap_current(root, version)
+    prune(root, version)
+
+    size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(root, version)))
+    metrics.inc('etl_rows_written_total', len(df), table='price_snapshot')
+    metrics.observe('etl_flush_seconds', time.monotonic() - started, table='price_snapshot')
+    logger.info(
+        f"Price snapshot {version}: {len(df)} units of {df['enstru_code'].nunique()} codes, "
+        f"{size / 2**20:.1f} MiB in {time.monotonic() - started:.1f}s"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped price snapshot read by the API workers")
+    parser.add_argument('--dir', default=PRICE_SNAPSHOT_DIR, help="snapshot root, defaults to PRICE_SNAPSHOT_DIR")
+    args = parser.parse_args()
+
+    db_session = SessionLocal()
+    try:
+        build_price_snapshot(db_session, args.dir)
+    finally:
+        db_session.close()
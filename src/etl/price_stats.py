@@ -0,0 +1,84 @@
+import time
+import argparse
+import logging
+from datetime import datetime
+from typing import List, Sequence
+from sqlalchemy import Select, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.db.session import SessionLocal
+from src.db.models import ContractUnit, PlanPoint, EnstruPriceStats, EnstruPriceStale
+from src.analytics.price_stats import price_stats_rows, stats_frame, units_select
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# codes recomputed and committed together
+BATCH_SIZE = 500
+INSERT_CHUNK = 1000
+
+def mark_stale(db: Session, codes: Select):
+    """
+    Queues `codes` (a select of ENSTRU codes) for recomputation. Runs in the
+    transaction writing the units, so a committed unit never leaves
+    fresh-looking statistics behind; only appends, so it takes no locks
+    another loader could wait on.
+    """
+    db.execute(
+        insert(EnstruPriceStale.__table__)
+        .from_select(['enstru_code', 'marked_at'], select(codes.subquery().c[0], func.now()))
+    )
+
+def codes_of_plans(plan_ids: Sequence) -> Select:
+    return select(PlanPoint.ref_enstru_code).where(
+        PlanPoint.id.in_(plan_ids), PlanPoint.ref_enstru_code.isnot(None)
+    ).distinct()
+
+def stale_codes(db: Session) -> List[str]:
+    return list(db.scalars(select(EnstruPriceStale.enstru_code).distinct()))
+
+def all_codes(db: Session) -> List[str]:
+    return list(db.scalars(
+        select(PlanPoint.ref_enstru_code).join(ContractUnit, ContractUnit.pln_point_id == PlanPoint.id)
+        .where(PlanPoint.ref_enstru_code.isnot(None)).distinct()
+    ))
+
+def refresh_codes(db: Session, codes: List[str]) -> int:
+    # dequeued before the units are read: a unit committed in between is either
+    # read below or keeps its own queue entry, never lost in between
+    db.query(EnstruPriceStale).filter(EnstruPriceStale.enstru_code.in_(codes)).delete(synchronize_session=False)
+    units = db.execute(units_select(codes)).all()
+    rows = price_stats_rows(stats_frame(units))
+
+    now = datetime.now()
+    db.query(EnstruPriceStats).filter(EnstruPriceStats.enstru_code.in_(codes)).delete(synchronize_session=False)
+    for start in range(0, len(rows), INSERT_CHUNK):
+        chunk = [dict(row, updated_at=now) for row in rows[start:start + INSERT_CHUNK]]
+        db.execute(insert(EnstruPriceStats.__table__).values(chunk))
+    return len(rows)
+
+def refresh_price_stats(db: Session, everything: bool = False):
+    """Recomputes the stale codes, or every code with units."""
+    codes = all_codes(db) if everything else stale_codes(db)
+    db.rollback()
+    if not codes:
+        logger.info("price statistics are up to date")
+        return
+    started = time.monotonic()
+    logger.info(f"refreshing price statistics of {len(codes)} codes")
+    written = 0
+    for start in range(0, len(codes), BATCH_SIZE):
+        written += refresh_codes(db, codes[start:start + BATCH_SIZE])
+        db.commit()
+    logger.info(f"price statistics refreshed: {len(codes)} codes, {written} rows in {time.monotonic() - started:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute enstru_price_stats for the codes touched since the last run")
+    parser.add_argument('--all', action='store_true', help="recompute every code with contract units")
+    args = parser.parse_args()
+
+    db_session = SessionLocal()
+    try:
+        refresh_price_stats(db_session, args.all)
+    finally:
+        db_session.close()
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+import logging
+from src.config import OWS_RATE_LIMIT, OWS_RATE_BURST
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Token bucket shared by every worker that talks to OWS with the same token.
+    Reservation is done under a plain lock, so one instance can be used from
+    threads and from any number of event loops at the same time.
+    """
+    def __init__(self, rate: float = OWS_RATE_LIMIT, burst: int = OWS_RATE_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # takes one token and returns how long the caller must wait before using it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """
+        Called on 429: every worker waits until the cooldown is over, and the
+        bucket is drained so they do not all fire at once afterwards.
+        """
+        with self.lock:
+            until = time.monotonic() + seconds
+            if until > self.blocked_until:
+                self.blocked_until = until
+                self.tokens = min(self.tokens, 0.0)
+                logger.warning(f"Rate limited (429). All workers paused for {seconds}s")
+
+# one bucket per process, OWS counts requests per token, not per connection
+shared_bucket = TokenBucket()
@@ -0,0 +1,124 @@
+import json
+import hashlib
+import argparse
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.db.session import SessionLocal
+from src.db.models import RefUnit, RefKato, RefEnstru, SyncState
+from src.etl.client import GoszakupClient
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# the dictionary hashes live in etl_sync_state under this scope, one stream per dictionary
+STATE_SCOPE = 'refs'
+
+@dataclass(frozen=True)
+class RefSpec:
+    path: str
+    model: type
+    decode: Callable[[dict], dict]
+
+REF_SPECS: Dict[str, RefSpec] = {
+    'ref_units': RefSpec('/v3/refs/ref_units', RefUnit, lambda item: dict(
+        code=item.get('code'),
+        name_ru=item.get('name_ru'),
+        name_kz=item.get('name_kz'),
+    )),
+    'ref_kato': RefSpec('/v3/refs/ref_kato', RefKato, lambda item: dict(
+        code=item.get('code'),
+        full_name_ru=item.get('full_name_ru') or item.get('name_ru'),
+        full_name_kz=item.get('full_name_kz') or item.get('name_kz'),
+    )),
+    'ref_enstru': RefSpec('/v3/refs/ref_enstru', RefEnstru, lambda item: dict(
+        code=item.get('code'),
+        name_ru=item.get('name_ru'),
+        name_kz=item.get('name_kz'),
+    )),
+}
+
+def fetch_dictionary(client: GoszakupClient, spec: RefSpec) -> List[dict]:
+    rows = {}
+    for item in client.paginate(spec.path):
+        row = spec.decode(item)
+        if row['code']:
+            rows[row['code']] = row
+    return [rows[code] for code in sorted(rows)]
+
+def dictionary_digest(rows: List[dict]) -> str:
+    return hashlib.sha256(json.dumps(rows, ensure_ascii=False, sort_keys=True, default=str).encode()).hexdigest()
+
+def sync_reference(client: GoszakupClient, db: Session, name: str, force: bool = False) -> bool:
+    """
+    Brings one reference table in line with its OWS dictionary. Returns False
+    when the dictionary is unchanged since the last applied run.
+
+    Codes are only inserted or renamed, never deleted: plans and contracts
+    keep pointing at codes the dictionary has dropped.
+    """
+    spec = REF_SPECS[name]
+    rows = fetch_dictionary(client, spec)
+    digest = dictionary_digest(rows)
+    state = db.get(SyncState, (STATE_SCOPE, name))
+    if state and state.digest == digest and not force:
+        logger.info(f"{name}: {len(rows)} codes, unchanged since {state.updated_at}")
+        return False
+
+    # exact diff against the table, reference tables are small enough to compare in memory
+    columns = [c for c in rows[0] if c != 'code'] if rows else []
+    stored = {
+        row.code: row
+        for row in db.query(spec.model.code, *(getattr(spec.model, c) for c in columns))
+    }
+    inserts = [row for row in rows if row['code'] not in stored]
+    updates = [
+        row for row in rows
+        if row['code'] in stored and any(getattr(stored[row['code']], c) != row[c] for c in columns)
+    ]
+    changed = inserts + updates
+    if changed:
+        stmt = insert(spec.model.__table__).values(changed)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['code'],
+            set_={c: stmt.excluded[c] for c in columns},
+        ))
+
+    values = dict(digest=digest, completed=True, updated_at=datetime.now())
+    state_stmt = insert(SyncState).values(scope=STATE_SCOPE, stream=name, **values)
+    db.execute(state_stmt.on_conflict_do_update(index_elements=['scope', 'stream'], set_=values))
+    db.commit()
+    logger.info(f"{name}: {len(rows)} codes, {len(inserts)} added, {len(updates)} renamed")
+    return True
+
+def sync_references(client: GoszakupClient, db: Session, names: List[str] = None, force: bool = False):
+    # one failed dictionary does not hold back the others, but the run still fails
+    failed = []
+    for name in names or REF_SPECS:
+        try:
+            sync_reference(client, db, name, force)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"{name} sync failed: {e}")
+            failed.append(name)
+    if failed:
+        raise RuntimeError(f"reference sync failed for {', '.join(failed)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync reference dictionaries from OWS")
+    parser.add_argument('names', nargs='*', metavar='NAME', help=f"dictionaries to sync ({', '.join(REF_SPECS)}), all by default")
+    parser.add_argument('--force', action='store_true', help="apply the diff even if the dictionary hash is unchanged")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(REF_SPECS)
+    if unknown:
+        parser.error(f"unknown dictionaries: {', '.join(sorted(unknown))}")
+
+    client = GoszakupClient()
+    db_session = SessionLocal()
+    try:
+        sync_references(client, db_session, args.names, args.force)
+    finally:
+        db_session.close()
@@ -0,0 +1,154 @@
+import time
+import asyncio
+import argparse
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from src.config import OWS_MAX_CONCURRENCY
+from src.db.session import SessionLocal
+from src.db.models import DeadLetter, Lot, ContractUnit
+from src.etl.async_client import AsyncGoszakupClient
+from src.etl.bulk import BulkWriter
+from src.etl.client import extract_items
+from src.etl.dead_letters import LOTS, CONTRACT_UNITS, MAX_ATTEMPTS, retry_delay
+from src.etl.decoders import LOT, CONTRACT_UNIT
+from src.etl.subjects import subject_registry
+from src.utils.cleaners import sanitize_lot_texts
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# letters fetched concurrently and committed together
+BATCH_SIZE = 200
+
+def lot_rows(letter: DeadLetter, items: list):
+    names = sanitize_lot_texts([item.get('name_ru') for item in items])
+    context = dict(trd_buy_id=letter.parent_id)
+    # letters of the announcement backfill have no BIN, their lots keep the customer_bin they carry
+    if letter.bin:
+        context['customer_bin'] = letter.bin
+    rows = []
+    for item, name in zip(items, names):
+        row = LOT.row(item, name_ru=name, **context)
+        subject_registry.see(row['customer_bin'])
+        rows.append((Lot, row))
+    return rows
+
+def unit_rows(letter: DeadLetter, items: list):
+    return [(ContractUnit, CONTRACT_UNIT.row(item, contract_id=letter.parent_id)) for item in items]
+
+# entity -> rows of the re-fetched sub-resource, decoded like the loaders do
+DECODERS: Dict[str, Callable[[DeadLetter, list], List[Tuple[type, dict]]]] = {
+    LOTS: lot_rows,
+    CONTRACT_UNITS: unit_rows,
+}
+
+def due_letters(db: Session, after_path: str, limit: int, entity: str = None, everything: bool = False):
+    query = db.query(DeadLetter).filter(DeadLetter.path > after_path)
+    if entity:
+        query = query.filter(DeadLetter.entity == entity)
+    if not everything:
+        query = query.filter(DeadLetter.retry_after <= datetime.now(), DeadLetter.attempts < MAX_ATTEMPTS)
+    return query.order_by(DeadLetter.path).limit(limit).all()
+
+def write_rows(db: Session, rows: List[Tuple[type, dict]]):
+    writer = BulkWriter(db)
+    for model, row in rows:
+        writer.add(model, row)
+    writer.flush()
+
+def db_error(e: SQLAlchemyError) -> str:
+    # the driver's message, without the statement and its parameters
+    return str(getattr(e, 'orig', None) or e).strip()
+
+def store_letters(db: Session, fetched: List[Tuple[DeadLetter, list]]) -> Dict[str, str]:
+    """
+    Writes the rows of the re-fetched letters, all in one savepoint and, when
+    that fails, letter by letter, so one bad letter does not hold back the
+    batch. Returns the error per letter that could not be written.
+    """
+    try:
+        with db.begin_nested():
+            write_rows(db, [row for _, rows in fetched for row in rows])
+        return {}
+    except SQLAlchemyError as e:
+        logger.warning(f"batch of {len(fetched)} letters failed, writing them one by one: {db_error(e)}")
+    errors = {}
+    for letter, rows in fetched:
+        try:
+            with db.begin_nested():
+                write_rows(db, rows)
+        except SQLAlchemyError as e:
+            logger.warning(f"{letter.path}: rows not written: {db_error(e)}")
+            errors[letter.path] = db_error(e)
+    return errors
+
+async def fetch_letter(client: AsyncGoszakupClient, letter: DeadLetter):
+    try:
+        return letter, extract_items(await client.get(letter.path)), None
+    except Exception as e:
+        return letter, None, str(e)
+
+async def replay_async(db: Session, workers: int, entity: str = None, everything: bool = False):
+    started = time.monotonic()
+    last_path = ''
+    replayed = 0
+    failed = 0
+    subject_registry.warm(db)
+    async with AsyncGoszakupClient(max_concurrency=workers) as client:
+        while True:
+            # keyset pagination, letters failing again stay behind the cursor
+            batch = due_letters(db, last_path, BATCH_SIZE, entity, everything)
+            if not batch:
+                break
+            last_path = batch[-1].path
+
+            now = datetime.now()
+            fetched, errors = [], {}
+            for letter, items, error in await asyncio.gather(*(fetch_letter(client, letter) for letter in batch)):
+                if error is not None:
+                    errors[letter.path] = error
+                    continue
+                fetched.append((letter, DECODERS[letter.entity](letter, items)))
+            if fetched:
+                errors.update(store_letters(db, fetched))
+
+            done = [letter.path for letter, _ in fetched if letter.path not in errors]
+            retries = []
+            for letter in batch:
+                if letter.path in errors:
+                    attempts = (letter.attempts or 0) + 1
+                    retries.append(dict(
+                        path=letter.path, attempts=attempts, last_error=errors[letter.path][:500],
+                        retry_after=now + retry_delay(attempts), updated_at=now,
+                    ))
+            if done:
+                db.query(DeadLetter).filter(DeadLetter.path.in_(done)).delete(synchronize_session=False)
+            if retries:
+                db.execute(update(DeadLetter), retries)
+            db.commit()
+
+            replayed += len(done)
+            failed += len(retries)
+            logger.info(f"{replayed} letters replayed, {failed} failed again, {(replayed + failed) / (time.monotonic() - started):.1f} letters/s")
+
+    logger.info(f"Replay complete. {replayed} sub-resources recovered, {failed} left for a later run.")
+
+def replay_dead_letters(db: Session, workers: int = OWS_MAX_CONCURRENCY, entity: str = None, everything: bool = False):
+    asyncio.run(replay_async(db, workers, entity, everything))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retry failed sub-resource fetches recorded in etl_dead_letters")
+    parser.add_argument('--workers', type=int, default=OWS_MAX_CONCURRENCY, help="fetches in flight at once")
+    parser.add_argument('--entity', choices=sorted(DECODERS), help="replay only this kind of sub-resource")
+    parser.add_argument('--all', action='store_true', help=f"ignore back-off and the {MAX_ATTEMPTS} attempts limit")
+    args = parser.parse_args()
+
+    db_session = SessionLocal()
+    try:
+        replay_dead_letters(db_session, args.workers, args.entity, args.all)
+    finally:
+        db_session.close()
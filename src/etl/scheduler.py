@@ -0,0 +1,280 @@
+import time
+import argparse
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Sequence, Set
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.config import ETL_WORKERS, ETL_REPORT_DIR
+from src.db.session import SessionLocal, engine
+from src.db.models import SyncState
+from src.etl.checkpoints import get_watermark, set_watermark
+from src.etl.client import GoszakupClient
+from src.etl.metrics import metrics
+from src.etl.refs_sync import sync_references
+from src.etl.enrich_kato import load_kato_dictionary
+from src.etl.enrich_enstru import enrich_enstru
+from src.etl.enrich_subjects import enrich_subjects
+from src.etl.enrich_missing_announcements import backfill_announcements
+from src.etl.replay_dead_letters import replay_dead_letters
+from src.etl.price_stats import refresh_price_stats
+from src.etl.anomaly_scan import scan_anomalies
+from src.etl.price_snapshot import build_price_snapshot
+from src.etl.load_historical import TARGET_BINS
+from src.etl.sync_daily import sync_plans_for_bin, sync_contracts_for_bin
+from src.etl.workers import BinJob, run_for_bins
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# start time of each stage's last successful run, as the watermark of (scope, stage)
+STATE_SCOPE = 'scheduler'
+# first key of the two-key advisory lock, the second is hashtext(stage name)
+LOCK_NAMESPACE = 7301
+TICK_SECONDS = 300
+# back-off after the first failure of a stage, doubled per failure, at most the stage's interval
+RETRY_FIRST = timedelta(minutes=15)
+
+# outcomes that let dependent stages run; between retries a failed stage is like one not due,
+# its dependents work on what is stored
+PASSED = ('ok', 'not due', 'partial', 'backing off')
+# outcomes of stages that actually ran
+RAN = ('ok', 'partial', 'failed')
+
+class PartialFailure(RuntimeError):
+    """Part of a stage's work failed; the stage is retried, its dependents run on the rest."""
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    run: Callable[[Session], None]
+    every: timedelta
+    after: Sequence[str] = ()
+
+def _for_bins(job: BinJob, workers: int):
+    def run(db: Session):
+        results = run_for_bins(job, TARGET_BINS, workers=workers)
+        failed = [r.bin for r in results if not r.ok]
+        if failed:
+            error = PartialFailure if len(failed) < len(results) else RuntimeError
+            raise error(f"{len(failed)} bins failed: {', '.join(failed)}")
+    return run
+
+def build_stages(workers: int = ETL_WORKERS, catch_up: bool = False) -> List[Stage]:
+    """
+    The ETL as a DAG. Stages whose dependencies are met run concurrently,
+    all OWS calls share one rate limiter:
+
+        refs -> plans -> contracts -> announcements
+                      -> enstru     -> subjects
+                                    -> dead_letters -> price_stats -> anomalies
+                                                                   -> price_snapshot
+        kato
+    """
+    return [
+        Stage('refs', lambda db: sync_references(GoszakupClient(), db, ['ref_units']), timedelta(days=1)),
+        Stage('kato', lambda db: load_kato_dictionary(GoszakupClient(), db), timedelta(days=7)),
+        Stage('plans', _for_bins(partial(sync_plans_for_bin, catch_up=catch_up), workers), timedelta(days=1), ('refs',)),
+        Stage('contracts', _for_bins(partial(sync_contracts_for_bin, catch_up=catch_up), workers), timedelta(days=1), ('plans',)),
+        Stage('announcements', backfill_announcements, timedelta(days=1), ('contracts',)),
+        Stage('enstru', enrich_enstru, timedelta(days=1), ('plans',)),
+        Stage('subjects', enrich_subjects, timedelta(days=1), ('contracts',)),
+        Stage('dead_letters', replay_dead_letters, timedelta(hours=6), ('contracts',)),
+        Stage('price_stats', refresh_price_stats, timedelta(hours=6), ('contracts', 'dead_letters')),
+        Stage('anomalies', scan_anomalies, timedelta(days=1), ('price_stats',)),
+        # after the refresh, a snapshot older than the statistics is bypassed for the refreshed codes
+        Stage('price_snapshot', build_price_snapshot, timedelta(hours=6), ('price_stats',)),
+    ]
+
+def topological_order(stages: List[Stage]) -> List[List[Stage]]:
+    """Groups stages into waves, every stage comes after the wave holding its last dependency."""
+    by_name = {s.name: s for s in stages}
+    for stage in stages:
+        unknown = set(stage.after) - set(by_name)
+        if unknown:
+            raise ValueError(f"stage {stage.name} depends on unknown stages: {', '.join(sorted(unknown))}")
+    waves, placed = [], set()
+    while len(placed) < len(stages):
+        wave = [s for s in stages if s.name not in placed and set(s.after) <= placed]
+        if not wave:
+            raise ValueError(f"dependency cycle among: {', '.join(s.name for s in stages if s.name not in placed)}")
+        waves.append(wave)
+        placed.update(s.name for s in wave)
+    return waves
+
+def is_due(db: Session, stage: Stage, now: datetime) -> bool:
+    last_run = get_watermark(db, STATE_SCOPE, stage.name)
+    return last_run is None or now - last_run >= stage.every
+
+def retry_after(db: Session, stage: Stage) -> Optional[datetime]:
+    state = db.get(SyncState, (STATE_SCOPE, stage.name))
+    return state.retry_after if state else None
+
+def set_failures(db: Session, stage: Stage, failures: int, now: datetime):
+    # zero clears the back-off
+    delay = min(RETRY_FIRST * 2 ** (failures - 1), stage.every) if failures else None
+    values = dict(failures=failures, retry_after=now + delay if delay else None, updated_at=now)
+    stmt = insert(SyncState).values(scope=STATE_SCOPE, stream=stage.name, **values)
+    db.execute(stmt.on_conflict_do_update(index_elements=['scope', 'stream'], set_=values))
+
+def run_stage(stage: Stage, force: bool) -> str:
+    # the advisory lock lives on its own connection for the whole stage, so a second
+    # scheduler (or a crashed one still holding the connection) never runs it twice
+    lock = engine.connect()
+    try:
+        locked = lock.execute(
+            text('SELECT pg_try_advisory_lock(:ns, hashtext(:stage))'), dict(ns=LOCK_NAMESPACE, stage=stage.name)
+        ).scalar()
+        lock.commit()
+        if not locked:
+            logger.warning(f"stage {stage.name}: running elsewhere, skipped")
+            return 'locked'
+        try:
+            return _run_locked(stage, force)
+        finally:
+            lock.execute(text('SELECT pg_advisory_unlock(:ns, hashtext(:stage))'), dict(ns=LOCK_NAMESPACE, stage=stage.name))
+            lock.commit()
+    finally:
+        lock.close()
+
+def _run_locked(stage: Stage, force: bool) -> str:
+    db = SessionLocal()
+    started = datetime.now()
+    clock = time.monotonic()
+    failures = 0
+    try:
+        # checked under the lock, another scheduler may have just finished the stage
+        if not force and not is_due(db, stage, started):
+            db.rollback()
+            logger.info(f"stage {stage.name}: not due")
+            return 'not due'
+        state = db.get(SyncState, (STATE_SCOPE, stage.name))
+        failures = (state.failures or 0) if state else 0
+        if not force and state and state.retry_after and started < state.retry_after:
+            db.rollback()
+            logger.info(f"stage {stage.name}: failed {failures} times, retrying after {state.retry_after:%Y-%m-%d %H:%M}")
+            return 'backing off'
+        db.rollback()
+        logger.info(f"stage {stage.name}: started")
+        stage.run(db)
+        set_watermark(db, STATE_SCOPE, stage.name, started)
+        set_failures(db, stage, 0, datetime.now())
+        db.commit()
+        logger.info(f"stage {stage.name}: done in {time.monotonic() - clock:.1f}s")
+        return 'ok'
+    except Exception as e:
+        db.rollback()
+        # no watermark, the stage stays due and is retried once the back-off has passed
+        set_failures(db, stage, failures + 1, datetime.now())
+        db.commit()
+        if isinstance(e, PartialFailure):
+            logger.warning(f"stage {stage.name}: partly failed after {time.monotonic() - clock:.1f}s: {e}")
+            return 'partial'
+        logger.exception(f"stage {stage.name}: failed after {time.monotonic() - clock:.1f}s")
+        return 'failed'
+    finally:
+        db.close()
+        metrics.observe('etl_stage_seconds', time.monotonic() - clock, stage=stage.name)
+
+def run_pass(stages: List[Stage], force: Set[str] = frozenset()) -> Dict[str, str]:
+    """
+    Runs every due stage once, each as soon as its dependencies have passed.
+    A failed, skipped-by-lock or blocked stage blocks everything after it in
+    that pass; a partly failed one (some BINs) lets its dependents run.
+    Returns the outcome per stage.
+    """
+    topological_order(stages)
+    outcome: Dict[str, str] = {}
+    pending = {s.name: s for s in stages}
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix='etl-stage') as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(dep not in outcome for dep in stage.after):
+                    continue
+                del pending[name]
+                blockers = [dep for dep in stage.after if outcome[dep] not in PASSED]
+                if blockers:
+                    logger.warning(f"stage {name}: blocked by {', '.join(blockers)}")
+                    outcome[name] = 'blocked'
+                    continue
+                running[pool.submit(run_stage, stage, name in force)] = name
+            if not running:
+                # only blocked stages were resolved, their dependents are ready now
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcome[running.pop(future)] = future.result()
+    for stage in stages:
+        metrics.inc('etl_stage_runs_total', stage=stage.name, outcome=outcome[stage.name])
+    return outcome
+
+def _interval(every: timedelta) -> str:
+    hours = every.total_seconds() / 3600
+    return f"{hours / 24:g}d" if hours % 24 == 0 else f"{hours:g}h"
+
+def log_plan(db: Session, stages: List[Stage], force: Set[str] = frozenset()):
+    now = datetime.now()
+    for number, wave in enumerate(topological_order(stages), start=1):
+        for stage in wave:
+            last_run = get_watermark(db, STATE_SCOPE, stage.name)
+            retry = retry_after(db, stage)
+            if stage.name in force:
+                state = "forced"
+            elif is_due(db, stage, now) and retry and now < retry:
+                state = f"failing, retry at {retry:%Y-%m-%d %H:%M}"
+            elif is_due(db, stage, now):
+                state = "due"
+            else:
+                state = f"next at {last_run + stage.every:%Y-%m-%d %H:%M}"
+            after = f" after {', '.join(stage.after)}" if stage.after else ""
+            logger.info(
+                f"wave {number}: {stage.name:<14} every {_interval(stage.every)}, last run {last_run or 'never'}, {state}{after}"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ETL stages as a dependency graph")
+    parser.add_argument('--workers', type=int, default=ETL_WORKERS, help="BINs synced in parallel by the BIN stages")
+    parser.add_argument('--catch-up', action='store_true', help="passed to the plans and contracts sync")
+    parser.add_argument('--only', nargs='+', metavar='STAGE', help="run only these stages, their dependencies are not required")
+    parser.add_argument('--force', nargs='*', metavar='STAGE', help="run these stages (all when none given) even if not due")
+    parser.add_argument('--dry-run', action='store_true', help="log the plan and which stages are due, run nothing")
+    parser.add_argument('--loop', action='store_true', help="keep running, re-checking schedules every --tick seconds")
+    parser.add_argument('--tick', type=int, default=TICK_SECONDS)
+    args = parser.parse_args()
+
+    stages = build_stages(args.workers, args.catch_up)
+    names = {s.name for s in stages}
+    unknown = (set(args.only or []) | set(args.force or [])) - names
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    if args.only:
+        stages = [Stage(s.name, s.run, s.every, tuple(d for d in s.after if d in args.only)) for s in stages if s.name in args.only]
+    force = set(args.force or []) or (names if args.force is not None else set())
+
+    if args.dry_run:
+        db_session = SessionLocal()
+        try:
+            log_plan(db_session, stages, force)
+        finally:
+            db_session.close()
+        raise SystemExit(0)
+
+    while True:
+        metrics.reset()
+        outcome = run_pass(stages, force)
+        logger.info("pass done: " + ", ".join(f"{name} {state}" for name, state in outcome.items()))
+        # a pass where nothing was due has nothing to report
+        if any(state in RAN for state in outcome.values()):
+            metrics.write_report(ETL_REPORT_DIR, 'scheduler')
+        if not args.loop:
+            break
+        # forcing applies to the first pass only
+        force = set()
+        time.sleep(args.tick)
+    if any(state in ('failed', 'partial', 'backing off', 'blocked') for state in outcome.values()):
+        raise SystemExit(1)
@@ -0,0 +1,92 @@
+import threading
+import logging
+from typing import Dict, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from src.db.models import Subject
+
+logger = logging.getLogger(__name__)
+
+class SubjectRegistry:
+    """
+    Process-wide view of subjects.bin and its role flags.
+
+    Loaders call `see` for every BIN they meet; only BINs that are new, or
+    whose is_customer/is_supplier flags grow, are queued. `flush` writes the
+    queue in one statement in its own transaction, so the subjects are
+    committed before any dependent row that references them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.known: Dict[str, Tuple[bool, bool]] = {}
+        self.pending: Dict[str, dict] = {}
+        self.warmed = False
+
+    def warm(self, db: Session):
+        with self.lock:
+            if self.warmed:
+                return
+            rows = db.query(Subject.bin, Subject.is_customer, Subject.is_supplier).filter(Subject.bin.isnot(None)).all()
+            for bin_number, is_customer, is_supplier in rows:
+                self.known[bin_number] = (bool(is_customer), bool(is_supplier))
+            self.warmed = True
+        logger.info(f"subject registry warmed with {len(rows)} bins")
+
+    def see(self, bin_number: str, name_ru: str = None, is_customer: bool = False, is_supplier: bool = False):
+        if not bin_number:
+            return
+        with self.lock:
+            row = self.pending.get(bin_number)
+            if row is None:
+                old_customer, old_supplier = self.known.get(bin_number, (False, False))
+                if bin_number in self.known and (old_customer or not is_customer) and (old_supplier or not is_supplier):
+                    return
+                row = self.pending[bin_number] = dict(
+                    bin=bin_number, name_ru=None, is_customer=old_customer, is_supplier=old_supplier
+                )
+            row['is_customer'] = row['is_customer'] or is_customer
+            row['is_supplier'] = row['is_supplier'] or is_supplier
+            row['name_ru'] = row['name_ru'] or name_ru
+
+    def flush(self, db: Session):
+        # serialized, so a caller never returns while another thread still holds its BINs uncommitted
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                queued, self.pending = self.pending, {}
+            rows = list(queued.values())
+
+            stmt = insert(Subject).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['bin'],
+                set_={
+                    'is_customer': Subject.is_customer.is_(True) | stmt.excluded.is_customer,
+                    'is_supplier': Subject.is_supplier.is_(True) | stmt.excluded.is_supplier,
+                    'name_ru': func.coalesce(Subject.name_ru, stmt.excluded.name_ru),
+                },
+            )
+            try:
+                # separate short transaction: once committed, the FK targets are there for every worker
+                with db.get_bind().begin() as conn:
+                    conn.execute(stmt)
+            except Exception:
+                # back into the queue, merged with what was seen meanwhile, so the next flush retries them
+                with self.lock:
+                    for bin_number, row in queued.items():
+                        newer = self.pending.get(bin_number)
+                        if newer is not None:
+                            row['is_customer'] = row['is_customer'] or newer['is_customer']
+                            row['is_supplier'] = row['is_supplier'] or newer['is_supplier']
+                            row['name_ru'] = row['name_ru'] or newer['name_ru']
+                        self.pending[bin_number] = row
+                raise
+
+            with self.lock:
+                for row in rows:
+                    self.known[row['bin']] = (row['is_customer'], row['is_supplier'])
+            logger.debug(f"registered {len(rows)} subjects")
+
+subject_registry = SubjectRegistry()
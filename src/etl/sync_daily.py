@@ -1,110 +1,198 @@
+import argparse
 import logging
+from dataclasses import replace
 from datetime import datetime, timedelta
+from functools import partial
+from typing import Iterator, Optional
+from sqlalchemy import Select, func, select
 from sqlalchemy.orm import Session
+from src.config import ETL_WORKERS, ETL_REPORT_DIR
 from src.db.session import SessionLocal
-from src.db.models import PlanPoint, Contract, ContractUnit
-from src.etl.client import GoszakupClient
-from src.etl.load_historical import TARGET_BINS, upsert_subject, parse_date
-from src.etl.enrich_missing_announcements import backfill_announcements, ensure_announcement
+from src.db.models import PlanPoint, Contract, ContractUnit, RefUnit
+from src.etl.bulk import BulkWriter
+from src.etl.checkpoints import get_watermark, set_watermark
+from src.etl.dead_letters import CONTRACT_UNITS, FailedFetch, dead_letter_row
+from src.etl.client import GoszakupClient, Page
+from src.etl.metrics import metrics
+from src.etl.pipeline import run_pipeline, filter_pages, skip_existing
+from src.etl.price_stats import refresh_price_stats
+from src.etl.subjects import subject_registry
+from src.etl.decoders import PLAN, CONTRACT, CONTRACT_UNIT, blank_to_none, parse_date
+from src.etl.load_historical import TARGET_BINS, CUTOFF_DATE as HISTORY_START, fetch_children
+from src.etl.enrich_missing_announcements import AnnouncementLoader, backfill_announcements
+from src.etl.workers import run_for_bins
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 SYNC_WINDOW_DAYS = 3
-CUTOFF_DATE = datetime.now() - timedelta(days=SYNC_WINDOW_DAYS)
+# re-read a little before the watermark, index_date is not strictly ordered across pages
+WATERMARK_OVERLAP = timedelta(hours=1)
 
-def sync_data_for_bin(client: GoszakupClient, db: Session, bin_number: str):
+class SyncWindow:
+    """
+    Lower bound of one (BIN, stream) sync and the newest update date seen in it.
+    """
+    def __init__(self, cutoff: datetime):
+        self.cutoff = cutoff
+        self.newest = None
+        self.oldest_skipped = None
+
+    def see(self, last_update: datetime):
+        if self.newest is None or last_update > self.newest:
+            self.newest = last_update
+
+    def skip(self, last_update: datetime):
+        # an item we could not store must be read again by the next run
+        if last_update and (self.oldest_skipped is None or last_update < self.oldest_skipped):
+            self.oldest_skipped = last_update
+
+    def next_watermark(self) -> Optional[datetime]:
+        if self.newest and self.oldest_skipped:
+            return min(self.newest, self.oldest_skipped - timedelta(microseconds=1))
+        return self.newest
+
+def sync_start(db: Session, bin_number: str, stream: str, latest_ingested: Select, catch_up: bool) -> datetime:
+    watermark = get_watermark(db, bin_number, stream)
+    if watermark:
+        return watermark - WATERMARK_OVERLAP
+    if catch_up:
+        # no watermark yet: continue from what the historical load left, or load the BIN from scratch
+        latest = db.execute(latest_ingested).scalar()
+        return latest - timedelta(days=SYNC_WINDOW_DAYS) if latest else HISTORY_START
+    logger.warning(f"no watermark for {stream} of {bin_number}, syncing the last {SYNC_WINDOW_DAYS} days")
+    return datetime.now() - timedelta(days=SYNC_WINDOW_DAYS)
+
+def item_update_date(item: dict, *date_keys: str) -> Optional[datetime]:
+    for key in date_keys:
+        last_update = parse_date(item.get(key))
+        if last_update:
+            return last_update
+    return None
+
+def until_cutoff(pages: Iterator[Page], window: SyncWindow, *date_keys: str) -> Iterator[Page]:
+    # pages come newest first, stop paginating at the first item older than the window
+    for page in pages:
+        items = []
+        for item in page.items:
+            last_update = item_update_date(item, *date_keys)
+            if last_update and last_update < window.cutoff:
+                yield replace(page, items=items, next_page=None)
+                return
+            if last_update:
+                window.see(last_update)
+            items.append(item)
+        yield page
+
+def sync_data_for_bin(client: GoszakupClient, db: Session, bin_number: str, catch_up: bool = False):
     logger.info(f"syncing bin {bin_number}")
-    upsert_subject(db, bin_number, is_customer=True)
-
-    existing_plans = {row[0] for row in db.query(PlanPoint.id).filter(PlanPoint.subject_biin == bin_number).all()}
-    existing_contracts = {row[0] for row in db.query(Contract.id).filter(Contract.customer_bin == bin_number).all()}
-    existing_units = {row[0] for row in db.query(ContractUnit.id).all()}
-    valid_plan_ids = existing_plans.copy()
-
-    logger.info("plans")
-    for item in client.paginate(f'/v3/plans/{bin_number}'):
-        last_update = parse_date(item.get('index_date')) or parse_date(item.get('timestamp'))
-        if last_update and last_update < CUTOFF_DATE:
-            break
-        if item['id'] in existing_plans:
-            continue
-        kato_list = item.get('kato', [])
-        plan = PlanPoint(
-            id=item['id'], 
-            subject_biin=bin_number, 
-            ref_enstru_code=item.get('ref_enstru_code'),
-            ref_units_code=item.get('ref_units_code'), 
-            price=item.get('price'),
-            count=item.get('count'), 
-            amount=item.get('amount'),
-            date_approved=parse_date(item.get('date_approved')),
-            kato_code=kato_list[0].get('ref_kato_code') if kato_list else None
-        )
-        db.merge(plan)
-        valid_plan_ids.add(item['id'])
-    db.commit()
-
-    logger.info("contracts and units")
-    for item in client.paginate(f'/v3/contract/customer/{bin_number}'):
-        last_update = parse_date(item.get('index_date')) or parse_date(item.get('crdate'))
-        if last_update and last_update < CUTOFF_DATE:
-            break
-        contract_id = item.get('id')
-        if contract_id not in existing_contracts:
-            trd_buy_id = item.get('trd_buy_id')
-            if trd_buy_id and not ensure_announcement(client, db, trd_buy_id):
-                logger.warning(f"skipping contract {contract_id}: announcement {trd_buy_id} could not be backfilled")
-                continue
+    sync_plans_for_bin(client, db, bin_number, catch_up)
+    sync_contracts_for_bin(client, db, bin_number, catch_up)
+
+def sync_plans_for_bin(client: GoszakupClient, db: Session, bin_number: str, catch_up: bool = False):
+    subject_registry.warm(db)
+    subject_registry.see(bin_number, is_customer=True)
+    # stored plans are left as they are, ON CONFLICT DO NOTHING dedups in the database
+    writer = BulkWriter(db)
+    known_units = {row[0] for row in db.query(RefUnit.code).all()}
+
+    latest_plan = select(func.max(PlanPoint.date_approved)).where(PlanPoint.subject_biin == bin_number)
+    plans_window = SyncWindow(sync_start(db, bin_number, 'plans', latest_plan, catch_up))
+    logger.info(f"plans since {plans_window.cutoff}")
+
+    def decode_plans(items):
+        rows = []
+        for item in items:
+            plan = PLAN.row(item, subject_biin=bin_number)
+            unit_code = plan['ref_units_code']
+            if unit_code and unit_code not in known_units:
+                rows.append((RefUnit, dict(code=unit_code, name_ru="Неизвестный код", name_kz="Белгісіз код")))
+                known_units.add(unit_code)
+            rows.append((PlanPoint, plan))
+        return rows
+
+    plan_pages = until_cutoff(client.iter_pages(f'/v3/plans/{bin_number}'), plans_window, 'index_date', 'timestamp')
+    run_pipeline(plan_pages, decode_plans, writer, db)
+    advance_watermark(db, bin_number, 'plans', plans_window)
 
-            raw_supplier_bin = item.get('supplier_biin')
-            supplier_bin = raw_supplier_bin if raw_supplier_bin and str(raw_supplier_bin).strip() else None
-
-            if supplier_bin:
-                upsert_subject(db, supplier_bin, is_supplier=True)
-            contract = Contract(
-                id=contract_id, 
-                contract_number=item.get('contract_number'), 
-                trd_buy_id=trd_buy_id if trd_buy_id else None,
-                crdate=parse_date(item.get('crdate')), 
-                contract_sum=item.get('contract_sum'),
-                supplier_biin=supplier_bin, 
-                customer_bin=bin_number,
-                ref_contract_status_id=item.get('ref_contract_status_id')
-            )
-            db.merge(contract)
-            try:
-                units_data = client.get(f'/v3/contract/{contract_id}/units')
-                units_items = units_data if isinstance(units_data, list) else units_data.get('items', [])
-                for u_item in units_items:
-                    unit_id = u_item.get('id')
-                    if unit_id in existing_units:
+def sync_contracts_for_bin(client: GoszakupClient, db: Session, bin_number: str, catch_up: bool = False):
+    subject_registry.warm(db)
+    subject_registry.see(bin_number, is_customer=True)
+    # units pointing at plans that are not stored get pln_point_id nulled by the writer
+    writer = BulkWriter(db)
+
+    latest_contract = select(func.max(Contract.crdate)).where(Contract.customer_bin == bin_number)
+    contracts_window = SyncWindow(sync_start(db, bin_number, 'contracts', latest_contract, catch_up))
+    logger.info(f"contracts and units since {contracts_window.cutoff}")
+    # the fetch stage runs in its own thread, so announcement backfill gets its own session
+    fetch_db = SessionLocal()
+
+    def with_announcements(pages):
+        # one batched backfill per page for the announcements its contracts point at,
+        # all through one client opened in the fetch thread for the whole stream
+        with AnnouncementLoader() as announcements:
+            for page in pages:
+                available = announcements.load(fetch_db, (item.get('trd_buy_id') for item in page.items))
+                items = []
+                for item in page.items:
+                    trd_buy_id = item.get('trd_buy_id')
+                    if trd_buy_id and trd_buy_id not in available:
+                        logger.warning(f"skipping contract {item.get('id')}: announcement {trd_buy_id} could not be backfilled")
+                        contracts_window.skip(item_update_date(item, 'index_date', 'crdate'))
                         continue
-                    raw_pln_id = u_item.get('pln_point_id')
-                    safe_pln_id = raw_pln_id if raw_pln_id in valid_plan_ids else None
-                    
-                    unit = ContractUnit(
-                        id=unit_id, 
-                        contract_id=contract_id, 
-                        pln_point_id=safe_pln_id,
-                        item_price=u_item.get('item_price'), 
-                        quantity=u_item.get('quantity'),
-                        total_sum=u_item.get('total_sum')
-                    )
-                    db.merge(unit)
-            except Exception:
-                pass
-    db.commit()
+                    items.append(item)
+                yield replace(page, items=items)
+
+    def with_units(item):
+        supplier_bin = blank_to_none(item.get('supplier_biin'))
+        if supplier_bin:
+            subject_registry.see(supplier_bin, is_supplier=True)
+        return item, fetch_children(client, f"/v3/contract/{item.get('id')}/units")
+
+    def decode_contracts(items):
+        rows = []
+        for item, units_items in items:
+            contract_id = item.get('id')
+            rows.append((Contract, CONTRACT.row(item, customer_bin=bin_number)))
+            if isinstance(units_items, FailedFetch):
+                rows.append(dead_letter_row(CONTRACT_UNITS, contract_id, units_items, bin_number))
+                continue
+            for u_item in units_items:
+                rows.append((ContractUnit, CONTRACT_UNIT.row(u_item, contract_id=contract_id)))
+        return rows
+
+    contract_pages = until_cutoff(client.iter_pages(f'/v3/contract/customer/{bin_number}'), contracts_window, 'index_date', 'crdate')
+    try:
+        contract_pages = with_announcements(skip_existing(contract_pages, fetch_db, Contract))
+        run_pipeline(filter_pages(contract_pages, with_units), decode_contracts, writer, db)
+    finally:
+        fetch_db.close()
+    advance_watermark(db, bin_number, 'contracts', contracts_window)
+
+def advance_watermark(db: Session, bin_number: str, stream: str, window: SyncWindow):
+    # only after the stream's rows are committed, a failed run is re-read from the old watermark
+    watermark = window.next_watermark()
+    if watermark:
+        set_watermark(db, bin_number, stream, watermark)
+        db.commit()
 
 if __name__ == "__main__":
-    client = GoszakupClient()
+    parser = argparse.ArgumentParser(description="Daily sync for TARGET_BINS")
+    parser.add_argument('--workers', type=int, default=ETL_WORKERS, help="BINs synced in parallel")
+    parser.add_argument('--catch-up', action='store_true',
+                        help="BINs without a watermark start from their newest ingested record instead of the last few days")
+    args = parser.parse_args()
+
+    logger.info("daily sync started")
+    results = run_for_bins(partial(sync_data_for_bin, catch_up=args.catch_up), TARGET_BINS, workers=args.workers)
+
     db_session = SessionLocal()
     try:
-        logger.info(f"daily sync started, cutoff {CUTOFF_DATE}")
-        for bin_code in TARGET_BINS:
-            sync_data_for_bin(client, db_session, bin_code)
-        logger.info("backfilling missing announcements")
-        backfill_announcements(client, db_session)
+        backfill_announcements(db_session)
+        refresh_price_stats(db_session)
         logger.info("daily sync done")
     finally:
         db_session.close()
+        metrics.write_report(ETL_REPORT_DIR, 'sync_daily')
+    if not all(r.ok for r in results):
+        raise SystemExit(1)
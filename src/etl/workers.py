@@ -0,0 +1,58 @@
+import time
+import logging
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from src.config import ETL_WORKERS
+from src.db.session import SessionLocal
+from src.etl.client import GoszakupClient
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BinJob = Callable[[GoszakupClient, Session, str], None]
+
+@dataclass
+class BinResult:
+    bin: str
+    ok: bool
+    seconds: float
+    error: Optional[str] = None
+
+def _run_one(job: BinJob, bin_number: str) -> BinResult:
+    # every worker owns its HTTP session and DB session, only the rate limiter is shared
+    client = GoszakupClient()
+    db = SessionLocal()
+    started = time.monotonic()
+    try:
+        job(client, db, bin_number)
+        return BinResult(bin=bin_number, ok=True, seconds=time.monotonic() - started)
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"bin {bin_number} failed")
+        return BinResult(bin=bin_number, ok=False, seconds=time.monotonic() - started, error=str(e))
+    finally:
+        db.close()
+        client.session.close()
+
+def run_for_bins(job: BinJob, bins: List[str], workers: int = ETL_WORKERS) -> List[BinResult]:
+    """
+    Runs `job` for every BIN on a thread pool of `workers` threads.
+    A failing BIN is reported in its result and does not stop the others.
+    """
+    workers = max(1, min(workers, len(bins) or 1))
+    logger.info(f"processing {len(bins)} bins with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='etl-bin') as pool:
+        results = list(pool.map(lambda b: _run_one(job, b), bins))
+    log_results(results)
+    return results
+
+def log_results(results: List[BinResult]):
+    failed = [r for r in results if not r.ok]
+    for r in results:
+        if r.ok:
+            logger.info(f"bin {r.bin}: ok in {r.seconds:.1f}s")
+        else:
+            logger.error(f"bin {r.bin}: failed in {r.seconds:.1f}s: {r.error}")
+    logger.info(f"{len(results) - len(failed)}/{len(results)} bins succeeded")
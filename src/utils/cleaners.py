@@ -1,6 +1,9 @@
 import re
 import html
-from typing import Optional
+from typing import Iterable, List, Optional
+
+_TAGS = re.compile(r'<[^>]+>')
+_WHITESPACE = re.compile(r'\s+')
 
 def sanitize_lot_text(text: Optional[str]) -> Optional[str]:
     """
@@ -8,15 +11,37 @@ def sanitize_lot_text(text: Optional[str]) -> Optional[str]:
     """
     if not text:
         return text
-        
+
     # Unescape HTML entities (e.g., &quot; -> ", &amp; -> &)
     cleaned = html.unescape(text)
-    
+
     # Remove HTML tags (e.g., <p>, <br>, <span>)
-    cleaned = re.sub(r'<[^>]+>', ' ', cleaned)
-    
+    cleaned = _TAGS.sub(' ', cleaned)
+
     # Remove weird non-breaking spaces and normalize whitespace
-    cleaned = re.sub(r'\s+', ' ', cleaned)
-    
+    cleaned = _WHITESPACE.sub(' ', cleaned)
+
     # Strip leading/trailing whitespace
-    return cleaned.strip()
\ No newline at end of file
+    return cleaned.strip()
+
+def sanitize_lot_texts(texts: Iterable[Optional[str]]) -> List[Optional[str]]:
+    """
+    Batch form of sanitize_lot_text. Unescaping and tag removal only run on
+    texts containing '&' or '<'; whitespace is normalized with str.split,
+    which splits on the same characters as \\s and strips the ends.
+    """
+    unescape = html.unescape
+    strip_tags = _TAGS.sub
+
+    cleaned = []
+    append = cleaned.append
+    for text in texts:
+        if not text:
+            append(text)
+            continue
+        if '&' in text:
+            text = unescape(text)
+        if '<' in text:
+            text = strip_tags(' ', text)
+        append(' '.join(text.split()))
+    return cleaned